@@ -0,0 +1,209 @@
+import argparse
+import concurrent.futures
+import json
+import os
+
+from game_state import GameState, STACK_COUNT
+from search import SearchContext, SEARCH_ENGINES, MAX_STATES, run_search
+
+# Maximum number of deals read ahead of the finished ones, bounds the memory use for any input size
+MAX_PENDING_PER_WORKER = 4
+
+
+def main():
+    arguments = parse_arguments()
+
+    context_options = dict(
+        allow_cheats=not arguments.no_cheats,
+        max_states=arguments.max_states,
+        macros=arguments.macros,
+        external_directory=arguments.external_directory,
+    )
+    if arguments.weight is not None:
+        context_options["weight"] = arguments.weight
+    if arguments.beam_width is not None:
+        context_options["beam_width"] = arguments.beam_width
+
+    with open(arguments.input) as input_file, open(arguments.output, "w") as output_file:
+        summary = solve_deals(
+            input_file, output_file, arguments.engine, arguments.workers, context_options
+        )
+
+    print(
+        "Solved",
+        summary["solved"],
+        "of",
+        summary["deals"],
+        "deals,",
+        summary["errors"],
+        "failed",
+        flush=True,
+    )
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Solves MOLEK-SYNTEZ solitaire deals offline. "
+        'Reads JSON lines like {"id": 1, "stacks": [[6, 7, ...], ...]} and writes one JSON line per result'
+    )
+    parser.add_argument("input", help="file with one deal per line")
+    parser.add_argument("output", help="file the results are written to")
+    parser.add_argument(
+        "--engine",
+        choices=sorted(SEARCH_ENGINES),
+        default="greedy",
+        help="search engine (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=MAX_STATES,
+        help="number of states searched per deal before giving up (default: %(default)s)",
+    )
+    parser.add_argument("--no-cheats", action="store_true", help="disallow cheating moves")
+    parser.add_argument(
+        "--macros",
+        action="store_true",
+        help="also search the sequences of moves that complete a collapse as single moves",
+    )
+    parser.add_argument(
+        "--external-directory",
+        help="directory the external engine writes its layer files into (default: a temporary directory)",
+    )
+    parser.add_argument("--weight", type=float, help="weight for the astar, ida and inplace engines")
+    parser.add_argument("--beam-width", type=int, help="beam width for the beam and external engines")
+    return parser.parse_args()
+
+
+def solve_deals(input_file, output_file, engine, workers, context_options):
+    """
+    Solves the deals read from input_file in a pool of worker processes, writing each result
+    to output_file as soon as it is done. Results are written in the order they finish
+    Returns a summary dictionary with the number of deals, solved deals and invalid or failed deals
+    """
+    summary = {"deals": 0, "solved": 0, "errors": 0}
+    max_pending = workers * MAX_PENDING_PER_WORKER
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # Input line number of each deal still being solved
+        pending = {}
+
+        for line_number, line in enumerate(input_file, 1):
+            if not line.strip():
+                continue
+
+            # Wait for some of the deals to finish before reading more of the input
+            if len(pending) >= max_pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                write_results(done, pending, output_file, summary)
+
+            future = executor.submit(solve_deal, line_number, line, engine, context_options)
+            pending[future] = line_number
+
+        while len(pending) > 0:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            write_results(done, pending, output_file, summary)
+
+    return summary
+
+
+def write_results(futures, pending, output_file, summary):
+    """
+    Writes the results of the finished futures to the output file, removes them from the pending ones and
+    updates the summary
+    A deal that failed is written as an error record with its line number, the other deals carry on
+    """
+    for future in futures:
+        line_number = pending.pop(future)
+        try:
+            result = future.result()
+        except Exception as error:
+            result = {"line": line_number, "error": repr(error)}
+
+        summary["deals"] += 1
+        if "error" in result:
+            summary["errors"] += 1
+        elif result["solved"]:
+            summary["solved"] += 1
+
+        output_file.write(json.dumps(result) + "\n")
+
+    output_file.flush()
+
+
+def solve_deal(line_number, line, engine, context_options):
+    """
+    Solves the deal on the given input line
+    Returns the result as a dictionary, or an error record with the line number if the deal is invalid or
+    the search fails
+    """
+    try:
+        deal = parse_deal(line)
+    except ValueError as error:
+        return {"line": line_number, "error": str(error)}
+
+    deal_id = deal.get("id", line_number)
+    try:
+        state = GameState.from_stacks(deal["stacks"], deal.get("cheats"))
+        result = run_search(engine, state, SearchContext(**context_options))
+    except Exception as error:
+        return {"line": line_number, "error": repr(error)}
+
+    return {
+        "id": deal_id,
+        "solved": result.solved,
+        "length": len(result.actions) if result.solved else None,
+        "states_searched": result.stats.states_searched,
+        "states_expanded": result.stats.states_expanded,
+        "time": round(result.stats.elapsed, 4),
+        "actions": result.actions if result.solved else None,
+    }
+
+
+def parse_deal(line):
+    """
+    Parses a deal from a JSON line, either an object with a "stacks" key or a plain list of stacks
+    Raises ValueError if the line is not a valid deal
+    """
+    deal = json.loads(line)
+    if isinstance(deal, list):
+        deal = {"stacks": deal}
+
+    stacks = deal.get("stacks") if isinstance(deal, dict) else None
+    if not isinstance(stacks, list) or len(stacks) != STACK_COUNT:
+        raise ValueError("Expected {} stacks".format(STACK_COUNT))
+
+    for stack in stacks:
+        if stack is None:
+            continue
+        if not isinstance(stack, list) or any(
+            not isinstance(card, int) or not 6 <= card <= 14 for card in stack
+        ):
+            raise ValueError("Stacks must be lists of card values from 6 to 14")
+
+    cheats = deal.get("cheats")
+    if cheats is not None and (
+        not isinstance(cheats, list)
+        or len(cheats) != STACK_COUNT
+        or any(not isinstance(cheat, bool) for cheat in cheats)
+    ):
+        raise ValueError("Expected {} boolean cheat flags".format(STACK_COUNT))
+
+    return deal
+
+
+if __name__ == "__main__":
+    main()
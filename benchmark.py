@@ -0,0 +1,299 @@
+import argparse
+import collections
+import json
+import math
+import platform
+import time
+import tracemalloc
+
+from deals import generate_deals
+from endgame import EndgameDatabase
+from game_state import GameState, get_heuristic_weights
+from portfolio import portfolio_search
+from search import SearchContext, SEARCH_ENGINES, MAX_STATES, run_search
+from tuning import load_heuristic_weights
+
+# The fixed corpus the benchmark is run on by default
+BENCHMARK_SEED = 1
+BENCHMARK_DEALS = 100
+
+# Summary values compared by --compare, and whether a higher value is better
+COMPARED_VALUES = {
+    "solve_rate": True,
+    "states_per_second": True,
+    "mean_states_searched": False,
+    "time_p50": False,
+    "time_p95": False,
+    "time_p99": False,
+    "peak_memory_mb": False,
+}
+
+
+def main():
+    arguments = parse_arguments()
+
+    if arguments.weights and load_heuristic_weights(arguments.weights) is None:
+        raise SystemExit("No such weights file: {}".format(arguments.weights))
+
+    context_options = dict(
+        allow_cheats=not arguments.no_cheats,
+        max_states=arguments.max_states,
+        prune=not arguments.no_prune,
+        macros=arguments.macros,
+    )
+    if arguments.weight is not None:
+        context_options["weight"] = arguments.weight
+    if arguments.beam_width is not None:
+        context_options["beam_width"] = arguments.beam_width
+
+    report = run_benchmark(
+        arguments.engine,
+        arguments.deals,
+        arguments.seed,
+        context_options,
+        arguments.trace_memory,
+        arguments.time_budget,
+        arguments.endgame,
+    )
+    print_report(report)
+
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as compare_file:
+            print_comparison(json.load(compare_file), report)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Runs the solver on a fixed seeded corpus of deals and reports its performance"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(SEARCH_ENGINES),
+        default="greedy",
+        help="search engine (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--deals",
+        type=int,
+        default=BENCHMARK_DEALS,
+        help="number of deals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=BENCHMARK_SEED,
+        help="seed of the deal corpus (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=MAX_STATES,
+        help="number of states searched per deal before giving up (default: %(default)s)",
+    )
+    parser.add_argument("--no-cheats", action="store_true", help="disallow cheating moves")
+    parser.add_argument(
+        "--no-prune", action="store_true", help="disable the pruning rules, to measure what they save"
+    )
+    parser.add_argument(
+        "--macros",
+        action="store_true",
+        help="also search the sequences of moves that complete a collapse as single moves",
+    )
+    parser.add_argument("--weight", type=float, help="weight for the astar, ida and inplace engines")
+    parser.add_argument("--beam-width", type=int, help="beam width for the beam and external engines")
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="race the strategies of portfolio.py for this many seconds per deal instead of using --engine",
+    )
+    parser.add_argument(
+        "--endgame",
+        help="finish the searches with the endgame database in this file built by endgame.py",
+    )
+    parser.add_argument("--weights", help="use the heuristic weights from this file written by tuning.py")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="measure the peak memory of each search with tracemalloc (slows down the search)",
+    )
+    parser.add_argument("--output", help="write the report as JSON into this file")
+    parser.add_argument("--compare", help="compare the results against an earlier JSON report")
+    return parser.parse_args()
+
+
+def run_benchmark(
+    engine, deal_count, seed, context_options, trace_memory=False, time_budget=None, endgame=None
+):
+    """
+    Solves the seeded deals one after another
+    With a time budget, each deal is solved with portfolio_search instead of the engine
+    With the path of an endgame database, the searches finish the endgames with it
+    Returns the report as a dictionary with the summary values and the results of each deal
+    """
+    results = []
+
+    # The database is shared by all deals, the endgames it solves on the spot are kept for the next ones
+    search_options = dict(context_options)
+    if endgame is not None:
+        search_options["endgame"] = EndgameDatabase(endgame)
+
+    for i, stacks in enumerate(generate_deals(deal_count, seed)):
+        state = GameState.from_stacks(stacks)
+
+        if trace_memory:
+            tracemalloc.start()
+
+        if time_budget is not None:
+            result = portfolio_search(state, time_budget, **search_options)
+        else:
+            result = run_search(engine, state, SearchContext(**search_options))
+
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+
+        results.append(
+            {
+                "deal": i,
+                "engine": result.engine,
+                "solved": result.solved,
+                "length": len(result.actions) if result.solved else None,
+                "states_searched": result.stats.states_searched,
+                "states_expanded": result.stats.states_expanded,
+                "states_pruned": result.stats.states_pruned,
+                "time": result.stats.elapsed,
+                "peak_memory_mb": peak_memory,
+            }
+        )
+
+    return {
+        "engine": engine if time_budget is None else "portfolio",
+        "time_budget": time_budget,
+        "endgame": endgame,
+        "seed": seed,
+        "deals": deal_count,
+        "options": context_options,
+        "heuristic_weights": get_heuristic_weights(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "summary": summarize(results, trace_memory),
+        "results": results,
+    }
+
+
+def summarize(results, trace_memory):
+    """
+    Returns the summary values of the given deal results
+    """
+    times = sorted(result["time"] for result in results)
+    total_time = sum(times)
+    total_states = sum(result["states_searched"] for result in results)
+    solved = [result for result in results if result["solved"]]
+
+    if trace_memory:
+        peak_memory = max(result["peak_memory_mb"] for result in results)
+    else:
+        peak_memory = get_peak_rss_mb()
+
+    return {
+        "solve_rate": len(solved) / len(results),
+        "states_per_second": total_states / total_time if total_time > 0 else 0.0,
+        "mean_states_searched": total_states / len(results),
+        "mean_solution_length": (
+            sum(result["length"] for result in solved) / len(solved) if solved else None
+        ),
+        "total_time": total_time,
+        "time_p50": percentile(times, 50),
+        "time_p95": percentile(times, 95),
+        "time_p99": percentile(times, 99),
+        "peak_memory_mb": peak_memory,
+    }
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the given percentile of the sorted values using the nearest-rank method
+    """
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident memory of this process in megabytes, or None if it is not available
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    if platform.system() == "Darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+def print_report(report):
+    """
+    Prints the summary of the report
+    """
+    summary = report["summary"]
+    print("Engine:", report["engine"], "Deals:", report["deals"], "Seed:", report["seed"])
+    print("Solve rate: {:.1%}".format(summary["solve_rate"]))
+    print("States per second: {:.0f}".format(summary["states_per_second"]))
+    print("Mean states searched: {:.0f}".format(summary["mean_states_searched"]))
+    if summary["mean_solution_length"] is not None:
+        print("Mean solution length: {:.1f}".format(summary["mean_solution_length"]))
+    print(
+        "Solve time p50/p95/p99: {:.3f}s / {:.3f}s / {:.3f}s".format(
+            summary["time_p50"], summary["time_p95"], summary["time_p99"]
+        )
+    )
+    if summary["peak_memory_mb"] is not None:
+        print("Peak memory: {:.1f} MB".format(summary["peak_memory_mb"]))
+
+    # Which strategy solved each deal when racing them
+    if report.get("time_budget") is not None:
+        wins = collections.Counter(result["engine"] for result in report["results"] if result["solved"])
+        for engine, count in wins.most_common():
+            print("Solved by {}: {}".format(engine, count))
+    print(flush=True)
+
+
+def print_comparison(baseline, report):
+    """
+    Prints the change of the summary values compared to the baseline report
+    """
+    if (baseline["seed"], baseline["deals"]) != (report["seed"], report["deals"]):
+        print("Warning: the reports were run on different deal corpora")
+
+    print("Compared to the baseline:")
+    for name, higher_is_better in COMPARED_VALUES.items():
+        old = baseline["summary"].get(name)
+        new = report["summary"].get(name)
+        if old is None or new is None or old == 0:
+            continue
+
+        change = (new - old) / old
+        improved = change > 0 if higher_is_better else change < 0
+        print(
+            "  {}: {:.4g} -> {:.4g} ({:+.1%}{})".format(
+                name, old, new, change, "" if change == 0 else ", better" if improved else ", worse"
+            )
+        )
+    print(flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,575 @@
+import random
+
+from game_state import COLLAPSE_RUN, HEURISTIC_BASE_HEIGHT, HEURISTIC_WEIGHTS, STACK_RANGE, GameState
+
+# Bit layout of a move encoded as an integer, see encode_action
+#   bits 0-2: source stack, bits 3-7: index of the bottom moved card in the source stack
+#   bits 8-10: target stack, bits 11-15: size of the target stack before the move
+#   bit 16: cheat, bit 17: collapse
+MOVE_CARD_SHIFT = 3
+MOVE_TARGET_SHIFT = 8
+MOVE_HEIGHT_SHIFT = 11
+MOVE_CHEAT = 1 << 16
+MOVE_COLLAPSE = 1 << 17
+MOVE_STACK_MASK = 0x7
+MOVE_INDEX_MASK = 0x1F
+
+# Zobrist keys, fixed by the seed so that hashes are the same in every process
+# A stack is hashed by XORing the key of each card at its height, and the key of the cheat flag if its top card
+# is cheated. The board hash is the sum of the mixed stack hashes, so it doesn't depend on the order of the stacks
+# just like GameState.canonical_key()
+ZOBRIST_SEED = 0x5A0B
+ZOBRIST_HEIGHTS = 40
+HASH_MASK = (1 << 64) - 1
+
+zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST_CARDS = [[zobrist_random.getrandbits(64) for _ in range(15)] for _ in range(ZOBRIST_HEIGHTS)]
+ZOBRIST_CHEAT = zobrist_random.getrandbits(64)
+ZOBRIST_COLLAPSED = zobrist_random.getrandbits(64)
+del zobrist_random
+
+
+class Board:
+    """
+    Mutable game state for searching in place
+    Instead of cloning a GameState for every action, an action is made on the board and unmade again when the
+    search backtracks. Actions are encoded as integers (see encode_action), and the board keeps a Zobrist hash
+    that is updated with the cards that move, so no state has to be hashed from scratch
+    """
+
+    __slots__ = (
+        "stacks",
+        "cheat_mask",
+        "run_lengths",
+        "stack_moves",
+        "stack_hashes",
+        "stack_keys",
+        "hash",
+        "undo",
+    )
+
+    def __init__(self, stacks, cheat_mask=0):
+        # Lists of card values, None for finished stacks
+        self.stacks = [list(stack) if stack is not None else None for stack in stacks]
+        self.cheat_mask = cheat_mask
+
+        # Length of the descending run on top of each stack, and the number of its cards that have to be moved
+        # at least once (see pruning.get_stack_moves)
+        self.run_lengths = [0] * len(self.stacks)
+        self.stack_moves = [0] * len(self.stacks)
+
+        # Zobrist hash of each stack, the mixed hash of each stack and their sum
+        self.stack_hashes = [0] * len(self.stacks)
+        self.stack_keys = [0] * len(self.stacks)
+        self.hash = 0
+
+        # Values overwritten by make, restored by unmake
+        self.undo = []
+
+        for i in STACK_RANGE:
+            self.update_stack(i)
+            self.stack_hashes[i] = get_stack_hash(self.stacks[i], cheat_mask & (1 << i))
+            self.stack_keys[i] = mix_hash(self.stack_hashes[i])
+        self.hash = sum(self.stack_keys) & HASH_MASK
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state.packed_stacks, state.cheat_mask)
+
+    def to_state(self):
+        """
+        Returns the board as a GameState
+        """
+        return GameState.from_stacks(self.stacks, [bool(self.cheat_mask & (1 << i)) for i in STACK_RANGE])
+
+    def update_stack(self, index):
+        """
+        Recalculates the run length and the moves needed of the stack at index
+        """
+        stack = self.stacks[index]
+        if not stack:
+            self.run_lengths[index] = 0
+            self.stack_moves[index] = 0
+            return
+
+        moves = 0 if stack[0] == 14 else 1
+        run_length = 1
+        in_run = True
+        for i in range(len(stack) - 1, 0, -1):
+            if stack[i - 1] != stack[i] + 1:
+                moves += 1
+                in_run = False
+            elif in_run:
+                run_length += 1
+
+        self.run_lengths[index] = run_length
+        self.stack_moves[index] = moves
+
+    def get_moves(self, allow_cheats):
+        """
+        Returns the legal actions as encoded moves, the same actions and in the same order as
+        GameState.get_legal_actions
+        """
+        moves = []
+        stacks = self.stacks
+        cheat_mask = self.cheat_mask
+        run_lengths = self.run_lengths
+
+        # Stacks that can be moved onto as 4-tuples (index, top, move bits, is_prefix), with is_prefix being
+        # True if the stack is a single run starting from 14 (or empty) and can still be completed into a collapse
+        targets = []
+        empty_stack_index = -1
+        for i in STACK_RANGE:
+            stack = stacks[i]
+            if stack is None or cheat_mask & (1 << i):
+                continue
+            if stack:
+                is_prefix = stack[0] == 14 and run_lengths[i] == len(stack)
+                targets.append((i, stack[-1], i << MOVE_TARGET_SHIFT | len(stack) << MOVE_HEIGHT_SHIFT, is_prefix))
+            else:
+                targets.append((i, 0, i << MOVE_TARGET_SHIFT, True))
+                if empty_stack_index < 0:
+                    empty_stack_index = i
+
+        for stack_index in STACK_RANGE:
+            stack = stacks[stack_index]
+            if not stack:
+                continue
+
+            stack_cheated = cheat_mask & (1 << stack_index)
+            top_index = len(stack) - 1
+            movable = 1 if stack_cheated else run_lengths[stack_index]
+            top_is_six = stack[top_index] == 6
+
+            for card_index in range(top_index, top_index - movable, -1):
+                card = stack[card_index]
+                move_from = stack_index | card_index << MOVE_CARD_SHIFT
+
+                if card == 14 and top_is_six and empty_stack_index >= 0:
+                    moves.append(move_from | empty_stack_index << MOVE_TARGET_SHIFT | MOVE_COLLAPSE)
+
+                for target_stack_index, target_top, target_move, target_is_prefix in targets:
+                    if stack_index == target_stack_index:
+                        continue
+
+                    if target_top == card + 1 or target_top == 0:
+                        if top_is_six and target_is_prefix and (target_top != 0 or card == 14):
+                            moves.append(move_from | target_move | MOVE_COLLAPSE)
+                        else:
+                            moves.append(move_from | target_move)
+                    elif allow_cheats and card_index == top_index and not stack_cheated:
+                        moves.append(move_from | target_move | MOVE_CHEAT)
+
+        return moves
+
+    def make(self, move):
+        """
+        Makes the encoded move on the board. Assumes that the move is legal
+        The hashes and the metadata of the two changed stacks are updated from the moved cards only
+        """
+        from_index = move & MOVE_STACK_MASK
+        card_index = move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+
+        stacks = self.stacks
+        stack_hashes = self.stack_hashes
+        stack_keys = self.stack_keys
+        run_lengths = self.run_lengths
+        stack_moves = self.stack_moves
+        cheat_mask = self.cheat_mask
+
+        # Everything unmake can't recalculate cheaply
+        self.undo.append(
+            (
+                cheat_mask,
+                self.hash,
+                stack_hashes[from_index],
+                stack_keys[from_index],
+                run_lengths[from_index],
+                stack_moves[from_index],
+                stack_hashes[to_index],
+                stack_keys[to_index],
+                run_lengths[to_index],
+                stack_moves[to_index],
+            )
+        )
+
+        source = stacks[from_index]
+        cards_moved = len(source) - card_index
+        bottom_card = source[card_index]
+        source_hash = stack_hashes[from_index]
+        if cheat_mask & (1 << from_index):
+            source_hash ^= ZOBRIST_CHEAT
+
+        if move & MOVE_COLLAPSE:
+            for i in range(card_index, len(source)):
+                source_hash ^= ZOBRIST_CARDS[i][source[i]]
+            stacks[to_index] = None
+            target_hash = ZOBRIST_COLLAPSED
+            run_lengths[to_index] = 0
+            stack_moves[to_index] = 0
+        else:
+            target = stacks[to_index]
+            target_hash = stack_hashes[to_index]
+            height = len(target)
+
+            # The moved cards are a descending run (or a single cheated card), so they add no breaks of their own
+            if move & MOVE_CHEAT:
+                target_hash ^= ZOBRIST_CHEAT
+                run_lengths[to_index] = 1
+                stack_moves[to_index] += 1
+            elif height:
+                run_lengths[to_index] += cards_moved
+            else:
+                run_lengths[to_index] = cards_moved
+                stack_moves[to_index] = 0 if bottom_card == 14 else 1
+
+            for i in range(card_index, len(source)):
+                card = source[i]
+                source_hash ^= ZOBRIST_CARDS[i][card]
+                target_hash ^= ZOBRIST_CARDS[height][card]
+                target.append(card)
+                height += 1
+        del source[card_index:]
+
+        # Only the rest of the top run stays on the source stack. If the whole run was moved, the break below it
+        # went with it, or the bottom card if the stack became empty
+        if cards_moved < run_lengths[from_index]:
+            run_lengths[from_index] -= cards_moved
+        elif source:
+            stack_moves[from_index] -= 1
+            run_length = 1
+            i = len(source) - 1
+            while i > 0 and source[i - 1] == source[i] + 1:
+                run_length += 1
+                i -= 1
+            run_lengths[from_index] = run_length
+        else:
+            run_lengths[from_index] = 0
+            stack_moves[from_index] = 0
+
+        cheat_mask &= ~(1 << from_index | 1 << to_index)
+        if move & MOVE_CHEAT:
+            cheat_mask |= 1 << to_index
+        self.cheat_mask = cheat_mask
+
+        # mix_hash, inlined as it's called twice for every move
+        value = (source_hash ^ (source_hash >> 30)) * 0xBF58476D1CE4E5B9 & HASH_MASK
+        value = (value ^ (value >> 27)) * 0x94D049BB133111EB & HASH_MASK
+        source_key = value ^ (value >> 31)
+        value = (target_hash ^ (target_hash >> 30)) * 0xBF58476D1CE4E5B9 & HASH_MASK
+        value = (value ^ (value >> 27)) * 0x94D049BB133111EB & HASH_MASK
+        target_key = value ^ (value >> 31)
+
+        self.hash = (
+            self.hash - stack_keys[from_index] - stack_keys[to_index] + source_key + target_key
+        ) & HASH_MASK
+        stack_hashes[from_index] = source_hash
+        stack_hashes[to_index] = target_hash
+        stack_keys[from_index] = source_key
+        stack_keys[to_index] = target_key
+
+    def unmake(self, move):
+        """
+        Takes back the encoded move, which must be the last move made on the board
+        """
+        from_index = move & MOVE_STACK_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+        to_height = move >> MOVE_HEIGHT_SHIFT & MOVE_INDEX_MASK
+
+        stacks = self.stacks
+        source = stacks[from_index]
+
+        if move & MOVE_COLLAPSE:
+            # The target was the start of the collapse run, the source held the rest of it
+            stacks[to_index] = list(COLLAPSE_RUN[:to_height])
+            source.extend(COLLAPSE_RUN[to_height:])
+        else:
+            target = stacks[to_index]
+            for i in range(to_height, len(target)):
+                source.append(target[i])
+            del target[to_height:]
+
+        (
+            self.cheat_mask,
+            self.hash,
+            self.stack_hashes[from_index],
+            self.stack_keys[from_index],
+            self.run_lengths[from_index],
+            self.stack_moves[from_index],
+            self.stack_hashes[to_index],
+            self.stack_keys[to_index],
+            self.run_lengths[to_index],
+            self.stack_moves[to_index],
+        ) = self.undo.pop()
+
+    def is_won(self):
+        for stack in self.stacks:
+            if stack:
+                return False
+        return True
+
+    def get_lower_bound(self):
+        """
+        Returns the lower bound of pruning.get_lower_bound for the board
+        """
+        return max(sum(self.stack_moves), 4 - self.stacks.count(None))
+
+    def get_move_lower_bound(self, move):
+        """
+        Returns the lower bound of get_lower_bound for the board after the encoded move, without making it
+        """
+        stacks = self.stacks
+        from_index = move & MOVE_STACK_MASK
+        card_index = move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+
+        moves = sum(self.stack_moves)
+        collapsed = stacks.count(None)
+
+        # Same changes as in make
+        source = stacks[from_index]
+        if len(source) - card_index >= self.run_lengths[from_index]:
+            moves -= 1 if card_index else self.stack_moves[from_index]
+
+        if move & MOVE_COLLAPSE:
+            collapsed += 1
+        elif move & MOVE_CHEAT:
+            moves += 1
+        elif not stacks[to_index] and source[card_index] != 14:
+            moves += 1
+
+        return max(moves, 4 - collapsed)
+
+    def get_move_hash(self, move):
+        """
+        Returns the hash of the board after the encoded move, without making it
+        """
+        stacks = self.stacks
+        from_index = move & MOVE_STACK_MASK
+        card_index = move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+
+        source = stacks[from_index]
+        source_hash = self.stack_hashes[from_index]
+        if self.cheat_mask & (1 << from_index):
+            source_hash ^= ZOBRIST_CHEAT
+
+        if move & MOVE_COLLAPSE:
+            for i in range(card_index, len(source)):
+                source_hash ^= ZOBRIST_CARDS[i][source[i]]
+            target_hash = ZOBRIST_COLLAPSED
+        else:
+            target_hash = self.stack_hashes[to_index]
+            if move & MOVE_CHEAT:
+                target_hash ^= ZOBRIST_CHEAT
+            height = len(stacks[to_index]) - card_index
+            for i in range(card_index, len(source)):
+                card = source[i]
+                source_hash ^= ZOBRIST_CARDS[i][card]
+                target_hash ^= ZOBRIST_CARDS[height + i][card]
+
+        stack_keys = self.stack_keys
+        return (
+            self.hash
+            - stack_keys[from_index]
+            - stack_keys[to_index]
+            + mix_hash(source_hash)
+            + mix_hash(target_hash)
+        ) & HASH_MASK
+
+    def get_move_heuristic_value(self, move, score):
+        """
+        Returns the heuristic value of the board after the encoded move, without making it
+        score is the heuristic value of the board, only the terms of the two changed stacks are recalculated
+        """
+        weights = HEURISTIC_WEIGHTS
+        stacks = self.stacks
+        run_lengths = self.run_lengths
+        from_index = move & MOVE_STACK_MASK
+        card_index = move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+
+        source = stacks[from_index]
+        target = stacks[to_index]
+        cards_moved = len(source) - card_index
+        source_run_length = run_lengths[from_index]
+        target_run_length = run_lengths[to_index]
+
+        score -= get_stack_score(len(source), source[0], source_run_length)
+        score -= get_stack_score(len(target), target[0] if target else 0, target_run_length)
+
+        # Same changes as in make
+        if cards_moved < source_run_length:
+            run_length = source_run_length - cards_moved
+        elif card_index:
+            run_length = 1
+            i = card_index - 1
+            while i > 0 and source[i - 1] == source[i] + 1:
+                run_length += 1
+                i -= 1
+        else:
+            run_length = 0
+        score += get_stack_score(card_index, source[0], run_length)
+        score += (run_length - source_run_length) * weights["run_length"]
+
+        if move & MOVE_COLLAPSE:
+            score += weights["collapsed_stack"] - target_run_length * weights["run_length"]
+        else:
+            if move & MOVE_CHEAT:
+                run_length = 1
+            elif target:
+                run_length = target_run_length + cards_moved
+            else:
+                run_length = cards_moved
+            bottom_card = target[0] if target else source[card_index]
+            score += get_stack_score(len(target) + cards_moved, bottom_card, run_length)
+            score += (run_length - target_run_length) * weights["run_length"]
+
+        cheat_mask = self.cheat_mask
+        cheats = (cheat_mask >> from_index & 1) + (cheat_mask >> to_index & 1)
+        if move & MOVE_CHEAT:
+            cheats -= 1
+        score -= cheats * weights["cheat"]
+
+        return score
+
+    def is_move_dead_end(self, move):
+        """
+        Returns True if no action would be possible on the board after the encoded move, see is_dead_end
+        """
+        from_index = move & MOVE_STACK_MASK
+        to_index = move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+
+        # Only a cheating move adds a cheated card, and emptying the source leaves an empty stack
+        if not move & MOVE_CHEAT or not move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK:
+            return False
+
+        cheat_mask = self.cheat_mask & ~(1 << from_index) | 1 << to_index
+        for i, stack in enumerate(self.stacks):
+            if stack is not None and not cheat_mask & (1 << i):
+                return False
+        return True
+
+    def is_dead_end(self):
+        """
+        Returns True if no action is possible on the board, see pruning.is_dead_end
+        """
+        cheat_mask = self.cheat_mask
+        if not cheat_mask:
+            return False
+
+        for i, stack in enumerate(self.stacks):
+            if stack is not None and not cheat_mask & (1 << i):
+                return False
+        return True
+
+    def get_heuristic_value(self):
+        """
+        Returns the same score as GameState.get_heuristic_value
+        """
+        weights = HEURISTIC_WEIGHTS
+        score = 0
+
+        for stack, run_length in zip(self.stacks, self.run_lengths):
+            if stack is None:
+                score += weights["collapsed_stack"]
+            else:
+                score += get_stack_score(len(stack), stack[0] if stack else 0, run_length)
+
+        score += sum(self.run_lengths) * weights["run_length"]
+        score += bin(self.cheat_mask).count("1") * weights["cheat"]
+
+        return score
+
+
+def get_stack_score(size, bottom_card, run_length):
+    """
+    Returns the terms of GameState.get_heuristic_value for a single stack that is not finished, given its size,
+    bottom card and the length of its top run. The run length and cheat terms are not included
+    """
+    weights = HEURISTIC_WEIGHTS
+
+    if size == 0:
+        return weights["empty_stack"]
+
+    score = 0
+    if size > HEURISTIC_BASE_HEIGHT:
+        score += (size - HEURISTIC_BASE_HEIGHT) * weights["stack_height"]
+    # A stack that is a single run starting from 14 can still be completed into a collapse
+    if bottom_card == 14 and run_length == size:
+        score += weights["prefix_stack"]
+    return score
+
+
+def get_stack_hash(stack, cheated):
+    """
+    Returns the Zobrist hash of a stack given as a list of card values, None for a finished stack
+    """
+    if stack is None:
+        return ZOBRIST_COLLAPSED
+
+    stack_hash = ZOBRIST_CHEAT if cheated else 0
+    for height, card in enumerate(stack):
+        stack_hash ^= ZOBRIST_CARDS[height][card]
+    return stack_hash
+
+
+def mix_hash(value):
+    """
+    Mixes the bits of a 64-bit hash (the splitmix64 finalizer), so that stack hashes can be summed into the
+    board hash without the XOR terms of different stacks cancelling out
+    """
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & HASH_MASK
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & HASH_MASK
+    return value ^ (value >> 31)
+
+
+def encode_action(action):
+    """
+    Returns the given action of GameState.get_legal_actions as an integer move
+    """
+    action_from = action[0]
+    action_to = action[1]
+
+    move = (
+        action_from[0]
+        | action_from[1] << MOVE_CARD_SHIFT
+        | action_to[2] << MOVE_TARGET_SHIFT
+        | action_to[3] << MOVE_HEIGHT_SHIFT
+    )
+    if action_to[0]:
+        move |= MOVE_CHEAT
+    if action_to[1]:
+        move |= MOVE_COLLAPSE
+    return move
+
+
+def decode_move(move):
+    """
+    Returns the integer move as an action of GameState.get_legal_actions
+    """
+    return (
+        (move & MOVE_STACK_MASK, move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK),
+        (
+            bool(move & MOVE_CHEAT),
+            bool(move & MOVE_COLLAPSE),
+            move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK,
+            move >> MOVE_HEIGHT_SHIFT & MOVE_INDEX_MASK,
+        ),
+    )
+
+
+def is_redundant_move(previous_move, move):
+    """
+    Returns True if the move picks up the cards the previous move just put down, see pruning.is_redundant_action
+    """
+    if previous_move is None or move & MOVE_CHEAT:
+        return False
+
+    previous_target = previous_move >> MOVE_TARGET_SHIFT & MOVE_STACK_MASK
+    previous_height = previous_move >> MOVE_HEIGHT_SHIFT & MOVE_INDEX_MASK
+    return (
+        move & MOVE_STACK_MASK == previous_target
+        and move >> MOVE_CARD_SHIFT & MOVE_INDEX_MASK == previous_height
+    )
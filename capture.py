@@ -0,0 +1,56 @@
+from PIL import Image, ImageGrab
+
+
+class ScreenCapture:
+    """
+    Captures images from the screen, grabbing only the requested rectangle
+    """
+
+    def __init__(self):
+        self.screen_size = None
+
+    def get_screen_size(self):
+        """
+        Returns the size of the main screen as a 2-tuple (width, height)
+        The screen is grabbed once to find out its size, later captures only grab the requested rectangles
+        """
+        if self.screen_size is None:
+            self.screen_size = ImageGrab.grab().size
+        return self.screen_size
+
+    def grab(self, box):
+        """
+        Returns an image of the given rectangle (left, top, right, bottom) of the screen
+        """
+        return ImageGrab.grab(bbox=box)
+
+
+class ImageFileCapture:
+    """
+    Captures images from a screenshot file instead of the screen, for testing without the game running
+    The file can be a screenshot of the whole screen or of the game view only
+    """
+
+    def __init__(self, path):
+        self.image = Image.open(path).convert("RGB")
+
+    def get_screen_size(self):
+        """
+        Returns the size of the screenshot as a 2-tuple (width, height)
+        """
+        return self.image.size
+
+    def grab(self, box):
+        """
+        Returns an image of the given rectangle (left, top, right, bottom) of the screenshot
+        """
+        return self.image.crop(box)
+
+
+def create_capture(image_path=None):
+    """
+    Returns a screen capture backend, or a screenshot file backend if a path is given
+    """
+    if image_path:
+        return ImageFileCapture(image_path)
+    return ScreenCapture()
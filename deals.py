@@ -0,0 +1,49 @@
+import argparse
+import json
+import random
+import sys
+
+from game_state import STACK_COUNT, INITIAL_STACK_SIZE, CARD_VALUES, CARD_COPIES
+
+
+def generate_deal(rng):
+    """
+    Shuffles the deck with the given random.Random instance and deals it into the stacks
+    Returns the stacks as a list of lists of card values, bottom card first
+    """
+    deck = [value for value in CARD_VALUES for _ in range(CARD_COPIES)]
+    rng.shuffle(deck)
+
+    return [
+        deck[i * INITIAL_STACK_SIZE : (i + 1) * INITIAL_STACK_SIZE] for i in range(STACK_COUNT)
+    ]
+
+
+def generate_deals(count, seed):
+    """
+    Yields count deals, the same ones for the same seed
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generate_deal(rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates random deals as JSON lines, the input format of batch.py"
+    )
+    parser.add_argument("count", type=int, help="number of deals")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument("--output", help="output file (default: standard output)")
+    arguments = parser.parse_args()
+
+    output_file = open(arguments.output, "w") if arguments.output else sys.stdout
+    for i, stacks in enumerate(generate_deals(arguments.count, arguments.seed)):
+        output_file.write(json.dumps({"id": i, "stacks": stacks}) + "\n")
+
+    if output_file is not sys.stdout:
+        output_file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import array
+import bisect
+import collections
+import mmap
+import os
+
+from deals import generate_deals
+from game_state import GameState
+from search import SearchContext, SEARCH_ENGINES, run_search
+from transposition import get_fingerprint
+
+# Boards with at least this many finished stacks are in the endgame: the remaining 9 cards can only reach a
+# few hundred states, small enough to be searched exhaustively for the exact number of actions to win
+ENDGAME_COLLAPSED_STACKS = 3
+
+# File the endgame database is read from by solver.py and written to by the builder below
+ENDGAME_FILE = "endgame.db"
+# Start of the database file, followed by the record count as an 8-byte unsigned integer
+ENDGAME_MAGIC = b"MOLEKEG1"
+ENDGAME_HEADER_SIZE = 16
+
+# Stored distance of a board that can't be won
+UNSOLVABLE = 255
+
+# Number of distances found on the spot kept in memory, with and without cheats each. They are cleared when the
+# limit is reached, so a database used for game after game doesn't grow without bounds
+MAX_FOUND_DISTANCES = 200000
+
+# Default corpus the builder solves to collect the endgames from
+BUILD_SEED = 1
+BUILD_DEALS = 100
+BUILD_ENGINE = "astar"
+BUILD_MAX_STATES = 50000
+
+
+class EndgameDatabase:
+    """
+    Exact number of actions needed to win every endgame board (see ENDGAME_COLLAPSED_STACKS)
+
+    The distances of the boards built offline are read from a file of records sorted by the fingerprint of
+    the canonical key of the board (transposition.get_fingerprint): an array of 8-byte fingerprints followed
+    by an array of 1-byte distances, both in the byte order of the machine that built it. The file is memory
+    mapped on the first lookup and searched with a binary search, so it costs nothing until a search reaches
+    the endgame and is shared between the processes using it
+
+    A board missing from the file is solved on the spot by exploring all the boards reachable from it (see
+    get_component_distances). The results are kept in memory, up to max_found of them, and written by save,
+    which is how the file is built. The file holds distances with cheats allowed, the ones without cheats are
+    always solved on the spot
+    """
+
+    def __init__(self, path=None, max_found=MAX_FOUND_DISTANCES):
+        self.path = path
+        self.fingerprints = None
+        self.distances = None
+        self.loaded = False
+
+        # Distances found on the spot, keyed by canonical key, with and without cheats
+        self.found = {True: {}, False: {}}
+        # If set, the found distances are cleared when they would grow past this size. None keeps all of them
+        # for save
+        self.max_found = max_found
+
+    def __getstate__(self):
+        # Sent to worker processes without the mapped file and the found distances, the file is mapped again
+        # on the first lookup in the worker
+        return {"path": self.path, "max_found": self.max_found}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["max_found"])
+
+    def __len__(self):
+        self.load()
+        return len(self.fingerprints) if self.fingerprints is not None else 0
+
+    def load(self):
+        """
+        Maps the database file into memory, if it wasn't already
+        A missing file is treated as an empty database
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+
+        if self.path is None or not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as database_file:
+            header = database_file.read(ENDGAME_HEADER_SIZE)
+            if header[:8] != ENDGAME_MAGIC:
+                raise ValueError("Not an endgame database: {}".format(self.path))
+            count = int.from_bytes(header[8:], "little")
+            if count == 0:
+                return
+            data = mmap.mmap(database_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        end = ENDGAME_HEADER_SIZE + count * 8
+        self.fingerprints = memoryview(data)[ENDGAME_HEADER_SIZE:end].cast("Q")
+        self.distances = memoryview(data)[end : end + count]
+
+    def is_endgame(self, stacks):
+        """
+        Returns True if a state or board with the given stacks (None for a finished stack) is in the endgame
+        """
+        return stacks.count(None) >= ENDGAME_COLLAPSED_STACKS
+
+    def get_distance(self, state, allow_cheats):
+        """
+        Returns the number of actions needed to win the endgame state, None if it can't be won
+        """
+        key = state.canonical_key()
+        found = self.found[allow_cheats]
+
+        distance = found.get(key)
+        if distance is None and allow_cheats:
+            distance = self.lookup(key)
+        if distance is None:
+            component = get_component_distances(state, allow_cheats)
+            if self.max_found is not None and len(found) + len(component) > self.max_found:
+                found.clear()
+            found.update(component)
+            distance = found[key]
+
+        return distance if distance != UNSOLVABLE else None
+
+    def lookup(self, key):
+        """
+        Returns the distance stored in the file for the canonical key, None if it is not in the file
+        """
+        self.load()
+        if self.fingerprints is None:
+            return None
+
+        fingerprint = get_fingerprint(key)
+        index = bisect.bisect_left(self.fingerprints, fingerprint)
+        if index < len(self.fingerprints) and self.fingerprints[index] == fingerprint:
+            return self.distances[index]
+        return None
+
+    def solve(self, state, allow_cheats):
+        """
+        Returns the shortest list of actions winning the endgame state, None if it can't be won
+        """
+        distance = self.get_distance(state, allow_cheats)
+        if distance is None:
+            return None
+
+        actions = []
+        while distance > 0:
+            for action in state.get_legal_actions(allow_cheats):
+                clone = state.clone()
+                clone.apply_action(action)
+                if self.get_distance(clone, allow_cheats) == distance - 1:
+                    break
+            else:
+                # Only possible with a fingerprint collision in the file
+                return None
+
+            actions.append(action)
+            state = clone
+            distance -= 1
+
+        return actions
+
+    def save(self, path):
+        """
+        Writes the distances in the file and the ones found with cheats allowed into the database file
+        Found distances that were cleared to stay within max_found are not written
+        Returns the number of records written
+        """
+        self.load()
+        records = {}
+        if self.fingerprints is not None:
+            records.update(zip(self.fingerprints, self.distances))
+        for key, distance in self.found[True].items():
+            records[get_fingerprint(key)] = distance
+
+        fingerprints = array.array("Q", sorted(records))
+        distances = bytes(records[fingerprint] for fingerprint in fingerprints)
+
+        # Written next to the target first, the old file may still be mapped
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as database_file:
+            database_file.write(ENDGAME_MAGIC + len(fingerprints).to_bytes(8, "little"))
+            database_file.write(fingerprints.tobytes())
+            database_file.write(distances)
+        os.replace(temporary_path, path)
+
+        return len(fingerprints)
+
+
+def get_component_distances(state, allow_cheats):
+    """
+    Explores every state reachable from the given endgame state and finds how many actions each one needs to
+    win, with a breadth-first search backwards from the won states
+    Returns a dictionary of the distances keyed by canonical key, UNSOLVABLE for the states that can't be won
+    """
+    start_key = state.canonical_key()
+    parents = collections.defaultdict(list)
+    seen = {start_key}
+    won = []
+
+    layer = [state]
+    while layer:
+        next_layer = []
+        for current_state in layer:
+            key = current_state.canonical_key()
+            if current_state.is_won():
+                won.append(key)
+                continue
+
+            for action in current_state.get_legal_actions(allow_cheats):
+                clone = current_state.clone()
+                clone.apply_action(action)
+
+                child_key = clone.canonical_key()
+                parents[child_key].append(key)
+                if child_key not in seen:
+                    seen.add(child_key)
+                    next_layer.append(clone)
+        layer = next_layer
+
+    distances = dict.fromkeys(seen, UNSOLVABLE)
+    for key in won:
+        distances[key] = 0
+
+    layer = won
+    distance = 0
+    while layer:
+        distance += 1
+        next_layer = []
+        for key in layer:
+            for parent_key in parents[key]:
+                if distances[parent_key] == UNSOLVABLE:
+                    distances[parent_key] = distance
+                    next_layer.append(parent_key)
+        layer = next_layer
+
+    return distances
+
+
+def main():
+    arguments = parse_arguments()
+
+    # Every found distance is kept until it is saved
+    database = EndgameDatabase(arguments.output, max_found=None)
+    start_count = len(database)
+
+    # The searches fill the database with every endgame they reach
+    for i, stacks in enumerate(generate_deals(arguments.deals, arguments.seed)):
+        context = SearchContext(max_states=arguments.max_states)
+        context.endgame = database
+        result = run_search(arguments.engine, GameState.from_stacks(stacks), context)
+
+        print(
+            "Deal {}: {}, {} endgame boards".format(
+                i, "solved" if result.solved else "not solved", len(database.found[True])
+            ),
+            flush=True,
+        )
+
+    count = database.save(arguments.output)
+    print("Wrote {} boards ({} new) to {}".format(count, count - start_count, arguments.output))
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Builds the endgame database by solving a seeded corpus of deals and storing the exact "
+        "distances of every endgame board the searches reach"
+    )
+    parser.add_argument(
+        "--output",
+        default=ENDGAME_FILE,
+        help="database file, boards already in it are kept (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(SEARCH_ENGINES),
+        default=BUILD_ENGINE,
+        help="search engine used to solve the deals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--deals",
+        type=int,
+        default=BUILD_DEALS,
+        help="number of deals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=BUILD_SEED,
+        help="seed of the deal corpus (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=BUILD_MAX_STATES,
+        help="number of states searched per deal (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
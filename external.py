@@ -0,0 +1,271 @@
+import heapq
+import mmap
+import os
+import struct
+
+from board import decode_move
+from game_state import STACK_RANGE, GameState
+
+# Number of records kept in memory before they are sorted and written into a run file
+EXTERNAL_BATCH_SIZE = 200000
+# Number of records read from a file at once
+EXTERNAL_READ_SIZE = 4096
+
+# Layout of a record, big-endian so that the records sort by their fingerprint as plain bytes
+#   bytes 0-7: fingerprint of the canonical key of the state (transposition.get_fingerprint)
+#   bytes 8-15: fingerprint of the parent state, bytes 16-19: encoded move leading to the state (board.encode_action)
+#   bytes 20-29: the score the layer is ranked by (see ExternalLayer.select), bytes 30-73: the state (see encode_state)
+FINGERPRINT_SIZE = 8
+MOVE_SIZE = 4
+SCORE_FORMAT = struct.Struct(">Hd")
+STATE_SIZE = 44
+MOVE_OFFSET = 2 * FINGERPRINT_SIZE
+SCORE_OFFSET = MOVE_OFFSET + MOVE_SIZE
+STATE_OFFSET = SCORE_OFFSET + SCORE_FORMAT.size
+RECORD_SIZE = STATE_OFFSET + STATE_SIZE
+# Move of the root record, which has no parent
+NO_MOVE = (1 << 8 * MOVE_SIZE) - 1
+# Size byte of a finished stack in an encoded state
+ENCODED_COLLAPSED = 0xFF
+# Every byte value as a bytes object, for encoding the sizes and the cheat mask
+ENCODED_SIZES = [bytes((value,)) for value in range(256)]
+
+
+class ExternalLayer:
+    """
+    Layer of a breadth-first search kept in files on disk, one fixed-size record per state (see RECORD_SIZE)
+
+    The records added to a layer are collected in memory and written into sorted run files in batches of
+    EXTERNAL_BATCH_SIZE. finish merges the runs into the layer file, dropping the duplicates within the layer
+    and the states already in earlier layers. This delayed duplicate detection needs only sequential reads of
+    sorted files, so neither the layers nor the visited states have to fit in memory
+
+    All the states of the layer stay in the layer file as visited states. select can narrow the states that are
+    expanded (iterated over) down to the best ranked ones, which are kept in a separate frontier file
+    """
+
+    def __init__(self, directory, depth):
+        self.path = os.path.join(directory, "layer{}.bin".format(depth))
+        self.frontier_path = self.path
+        self.buffer = []
+        self.runs = []
+        # Records added, and the states left after finish
+        self.added = 0
+        self.count = 0
+        self.data = None
+
+    def add(self, fingerprint, parent_fingerprint, move, state, distance_estimate, heuristic_score):
+        """
+        Adds the state reached from the parent state with the encoded move, ranked by its distance estimate
+        and heuristic score
+        """
+        self.buffer.append(
+            fingerprint.to_bytes(FINGERPRINT_SIZE, "big")
+            + parent_fingerprint.to_bytes(FINGERPRINT_SIZE, "big")
+            + move.to_bytes(MOVE_SIZE, "big")
+            + SCORE_FORMAT.pack(distance_estimate, heuristic_score)
+            + encode_state(state)
+        )
+        self.added += 1
+
+        if len(self.buffer) >= EXTERNAL_BATCH_SIZE:
+            self.spill()
+
+    def spill(self):
+        """
+        Writes the records in memory into a new sorted run file
+        """
+        self.buffer.sort()
+        path = "{}.run{}".format(self.path, len(self.runs))
+        with open(path, "wb") as run_file:
+            run_file.write(b"".join(self.buffer))
+
+        self.runs.append(path)
+        self.buffer = []
+
+    def finish(self, earlier_layers):
+        """
+        Merges the run files into the layer file, keeping a single record per state and dropping the states
+        found in the earlier layers, which were reached with fewer actions
+        Returns the number of dropped duplicates
+        """
+        if self.buffer:
+            self.spill()
+
+        earlier_fingerprints = heapq.merge(*(layer.get_fingerprints() for layer in earlier_layers))
+        earlier_fingerprint = next(earlier_fingerprints, None)
+        previous_fingerprint = None
+        duplicates = 0
+
+        with open(self.path, "wb") as layer_file:
+            for record in heapq.merge(*(read_records(path) for path in self.runs)):
+                fingerprint = record[:FINGERPRINT_SIZE]
+                if fingerprint == previous_fingerprint:
+                    duplicates += 1
+                    continue
+                previous_fingerprint = fingerprint
+
+                while earlier_fingerprint is not None and earlier_fingerprint < fingerprint:
+                    earlier_fingerprint = next(earlier_fingerprints, None)
+                if earlier_fingerprint == fingerprint:
+                    duplicates += 1
+                    continue
+
+                layer_file.write(record)
+                self.count += 1
+
+        for path in self.runs:
+            os.remove(path)
+        self.runs = []
+
+        return duplicates
+
+    def select(self, width):
+        """
+        Narrows the states expanded from the finished layer down to the width states with the lowest distance
+        estimates, ties broken by the highest heuristic score, like beam_search
+        Only the selected records are held in memory
+        Returns the number of states left out
+        """
+        if self.count <= width:
+            return 0
+
+        selected = heapq.nsmallest(width, read_records(self.path), key=get_record_rank)
+        selected.sort()
+
+        self.frontier_path = self.path + ".frontier"
+        with open(self.frontier_path, "wb") as frontier_file:
+            frontier_file.write(b"".join(selected))
+
+        return self.count - width
+
+    def __iter__(self):
+        """
+        Yields the states of the finished layer that are expanded as 3-tuples (fingerprint, move, state)
+        """
+        for record in read_records(self.frontier_path):
+            yield (
+                int.from_bytes(record[:FINGERPRINT_SIZE], "big"),
+                int.from_bytes(record[MOVE_OFFSET:SCORE_OFFSET], "big"),
+                decode_state(record[STATE_OFFSET:]),
+            )
+
+    def get_fingerprints(self):
+        """
+        Yields the fingerprints of the states of the finished layer in sorted order, as bytes
+        """
+        for record in read_records(self.path):
+            yield record[:FINGERPRINT_SIZE]
+
+    def find(self, fingerprint):
+        """
+        Returns a 2-tuple (parent_fingerprint, move) of the state with the given fingerprint in the finished layer,
+        None if it isn't in the layer
+        The layer file is memory mapped on the first call and searched with a binary search
+        """
+        if self.count == 0:
+            return None
+        if self.data is None:
+            with open(self.path, "rb") as layer_file:
+                self.data = mmap.mmap(layer_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        key = fingerprint.to_bytes(FINGERPRINT_SIZE, "big")
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD_SIZE
+            if self.data[offset : offset + FINGERPRINT_SIZE] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        offset = low * RECORD_SIZE
+        if low == self.count or self.data[offset : offset + FINGERPRINT_SIZE] != key:
+            return None
+
+        return (
+            int.from_bytes(self.data[offset + FINGERPRINT_SIZE : offset + MOVE_OFFSET], "big"),
+            int.from_bytes(self.data[offset + MOVE_OFFSET : offset + SCORE_OFFSET], "big"),
+        )
+
+    def remove(self):
+        """
+        Deletes the files of the layer
+        """
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        for path in self.runs + [self.path, self.frontier_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_layer_actions(layers, depth, fingerprint):
+    """
+    Returns the actions leading from the root of the layers to the state with the given fingerprint, found
+    in the layer at the given depth or, if it was dropped there as a duplicate, in an earlier layer
+    """
+    actions = []
+    while depth > 0:
+        found = layers[depth].find(fingerprint)
+        depth -= 1
+        if found is not None:
+            fingerprint, move = found
+            actions.append(decode_move(move))
+
+    actions.reverse()
+    return actions
+
+
+def get_record_rank(record):
+    """
+    Returns the sort key of a record for ExternalLayer.select, lowest first
+    """
+    distance_estimate, heuristic_score = SCORE_FORMAT.unpack_from(record, SCORE_OFFSET)
+    return distance_estimate, -heuristic_score
+
+
+def read_records(path):
+    """
+    Yields the records of a layer or run file in order
+    """
+    with open(path, "rb") as records_file:
+        while True:
+            data = records_file.read(RECORD_SIZE * EXTERNAL_READ_SIZE)
+            if not data:
+                break
+            for offset in range(0, len(data), RECORD_SIZE):
+                yield data[offset : offset + RECORD_SIZE]
+
+
+def encode_state(state):
+    """
+    Returns the state encoded as STATE_SIZE bytes: the size of each stack followed by its cards, ENCODED_COLLAPSED
+    for a finished stack, then the cheat mask
+    """
+    parts = [
+        ENCODED_SIZES[len(stack)] + stack if stack is not None else ENCODED_SIZES[ENCODED_COLLAPSED]
+        for stack in state.packed_stacks
+    ]
+    parts.append(ENCODED_SIZES[state.cheat_mask])
+    return b"".join(parts).ljust(STATE_SIZE, b"\0")
+
+
+def decode_state(data):
+    """
+    Returns the GameState encoded by encode_state
+    """
+    stacks = []
+    offset = 0
+    for _ in STACK_RANGE:
+        size = data[offset]
+        offset += 1
+        if size == ENCODED_COLLAPSED:
+            stacks.append(None)
+        else:
+            stacks.append(data[offset : offset + size])
+            offset += size
+
+    cheat_mask = data[offset]
+    return GameState.from_stacks(stacks, [cheat_mask & (1 << i) for i in STACK_RANGE])
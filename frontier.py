@@ -0,0 +1,52 @@
+import heapq
+import itertools
+
+
+class Frontier:
+    """
+    Search frontier backed by a binary heap
+    Always pops the item with the highest score. Items with equal scores are popped
+    in reverse insertion order, the most recently pushed item first
+    """
+
+    def __init__(self, max_size=None):
+        # Heap of (-score, -insertion_order, item) tuples
+        self.heap = []
+        self.counter = itertools.count()
+
+        # If set, the lowest-scored items are evicted when the frontier grows past this size
+        self.max_size = max_size
+        self.evicted = 0
+
+    def push(self, item, score):
+        """
+        Adds the given item to the frontier with the given score
+        """
+        heapq.heappush(self.heap, (-score, -next(self.counter), item))
+
+        if self.max_size is not None and len(self.heap) > self.max_size + max(
+            1, self.max_size // 10
+        ):
+            self.trim()
+
+    def pop(self):
+        """
+        Removes and returns the highest-scored item as a 2-tuple (item, score)
+        """
+        entry = heapq.heappop(self.heap)
+        return entry[2], -entry[0]
+
+    def trim(self):
+        """
+        Evicts the lowest-scored items so that only max_size items remain
+        Trimming is done in batches (the frontier can overshoot max_size by 10%) to keep it amortized
+        """
+        if self.max_size is None or len(self.heap) <= self.max_size:
+            return
+
+        self.evicted += len(self.heap) - self.max_size
+        # A sorted list is a valid heap, no need to heapify again
+        self.heap = heapq.nsmallest(self.max_size, self.heap)
+
+    def __len__(self):
+        return len(self.heap)
@@ -4,40 +4,110 @@ MAX_STACK_SIZE = 15
 
 STACK_RANGE = range(STACK_COUNT)
 
+# The deck has four cards of each value from 6 to 14
+CARD_VALUES = range(6, 15)
+CARD_COPIES = 4
+
+# Packed form of an empty stack. Each card is stored as a single byte holding its value
+EMPTY_STACK = b""
+
+# A stack that can be completed into a collapse must start with these cards from the bottom
+COLLAPSE_RUN = bytes(range(14, 5, -1))
+
+# Bytes used in the canonical encoding of a state. Card values are always between 6 and 14
+CANONICAL_COLLAPSED = b"\x00"
+CANONICAL_CHEAT = b"\x01"
+CANONICAL_SEPARATOR = b"\xff"
+
+# Weights of the terms of GameState.get_heuristic_value, replaced with tuned weights by set_heuristic_weights
+#   collapsed_stack: per finished stack
+#   empty_stack: per empty stack
+#   stack_height: per card above HEURISTIC_BASE_HEIGHT in a stack
+#   cheat: per cheated card
+#   run_length: per card in the descending runs on top of the stacks
+#   prefix_stack: per non-empty stack that can still be completed into a collapse
+HEURISTIC_WEIGHTS = {
+    "collapsed_stack": 50,
+    "empty_stack": 10,
+    "stack_height": 2,
+    "cheat": -15,
+    "run_length": 0,
+    "prefix_stack": 0,
+}
+HEURISTIC_BASE_HEIGHT = 5
+
 
 class GameState:
+    # The state is kept in a compact, immutable form so that cloning only copies references
+    # and hashing can use the native tuple/bytes hashes
+    __slots__ = (
+        "packed_stacks",
+        "cheat_mask",
+        "run_lengths",
+        "prefix_mask",
+        "tops",
+        "actions_taken",
+    )
+
     def __init__(self):
         self.actions_taken = 0
 
-        # List of lists of tuples
-        # Finished stacks become None - won state contains 4 Nones and 2 empty lists
-        self.stacks = []
+        # Tuple of bytes objects, one per stack, each byte being the value of a card
+        # Finished stacks become None - won state contains 4 Nones and 2 empty stacks
+        self.packed_stacks = (EMPTY_STACK,) * STACK_COUNT
 
-        # List of booleans
-        # True if the stack at index i has a cheated card on top
-        self.cheats = []
+        # Bitmask of cheated stacks
+        # Bit i is set if the stack at index i has a cheated card on top
+        self.cheat_mask = 0
 
-        # Initialize all stacks as empty
-        for i in STACK_RANGE:
-            self.stacks.append([])
-            self.cheats.append(False)
+        # Metadata of each stack for generating the legal actions, kept up to date by apply_action
+        # Length of the descending run on top of the stack (0 for empty and finished stacks)
+        self.run_lengths = (0,) * STACK_COUNT
+        # Bit i is set if the stack at index i is empty or starts with 14, 13, ... (a prefix of COLLAPSE_RUN)
+        self.prefix_mask = (1 << STACK_COUNT) - 1
+        # Value of the card on top of the stack (0 for empty and finished stacks)
+        self.tops = (0,) * STACK_COUNT
 
-    def clone(self):
+    @classmethod
+    def from_stacks(cls, stacks, cheats=None):
         """
-            Clones the given GameState object
+            Creates a state from a list of stacks given as lists of card values (None for finished stacks),
+            and optionally a list of cheat flags
+        """
+        state = cls()
+        state.packed_stacks = tuple(bytes(stack) if stack is not None else None for stack in stacks)
+        if cheats is not None:
+            for i in STACK_RANGE:
+                if cheats[i]:
+                    state.cheat_mask |= 1 << i
+        state.update_metadata()
+        return state
+
+    @property
+    def stacks(self):
         """
-        clone = GameState()
+            Returns the stacks as a list of lists of card values, None for finished stacks
+            The returned lists are copies, modifying them does not change the state
+        """
+        return [list(stack) if stack is not None else None for stack in self.packed_stacks]
 
-        for i in STACK_RANGE:
-            clone.cheats[i] = self.cheats[i]
-            if self.stacks[i] is None:
-                clone.stacks[i] = None
-                continue
-            for j in range(len(self.stacks[i])):
-                # Copy each card from each stack
-                card = self.stacks[i][j]
-                clone.stacks[i].append(card)
+    @property
+    def cheats(self):
+        """
+            Returns a list of booleans, True if the stack at index i has a cheated card on top
+        """
+        return [bool(self.cheat_mask & (1 << i)) for i in STACK_RANGE]
 
+    def clone(self):
+        """
+            Clones the given GameState object
+        """
+        clone = GameState.__new__(GameState)
+        clone.packed_stacks = self.packed_stacks
+        clone.cheat_mask = self.cheat_mask
+        clone.run_lengths = self.run_lengths
+        clone.prefix_mask = self.prefix_mask
+        clone.tops = self.tops
         clone.actions_taken = self.actions_taken
 
         return clone
@@ -47,8 +117,8 @@ class GameState:
             Determine if the current state is the won end state
         """
         # If any stack has open cards, return False
-        for i in STACK_RANGE:
-            if self.stacks[i] is not None and len(self.stacks[i]) > 0:
+        for stack in self.packed_stacks:
+            if stack:
                 return False
 
         return True
@@ -58,8 +128,8 @@ class GameState:
             Return the card that is on top of the given stack at index. Returns None if stack is empty or finished
             Does not remove the card from the stack
         """
-        stack = self.stacks[index]
-        if stack is None or len(stack) == 0:
+        stack = self.packed_stacks[index]
+        if not stack:
             return None
         return stack[-1]
 
@@ -67,26 +137,44 @@ class GameState:
         """
             Returns the total card count in the stacks
         """
-        return sum([len(x) for x in self.stacks])
+        return sum([len(x) for x in self.packed_stacks if x is not None])
 
     def pull_from_stack(self, index, count):
         """
-            Return given number of cards from the given stack
+            Return given number of cards from the given stack as packed bytes
             Removes the said cards from the stack
         """
-        stack = self.stacks[index]
-        start = stack[:-count]
-        end = stack[-count:]
+        stack = self.packed_stacks[index]
+        split = len(stack) - count
 
         # Set the "new" stack and return the extra
-        self.stacks[index] = start
-        return end
+        stacks = list(self.packed_stacks)
+        stacks[index] = stack[:split]
+        self.packed_stacks = tuple(stacks)
+        self.update_metadata()
+        return stack[split:]
 
     def parse_card_into_stack(self, index, card):
         """
             Puts the given card at the top of the stack, used in the image parsing
         """
-        self.stacks[index].append(card)
+        stacks = list(self.packed_stacks)
+        stacks[index] += bytes((card,))
+        self.packed_stacks = tuple(stacks)
+        self.update_metadata()
+
+    def update_metadata(self):
+        """
+            Recalculates the metadata of all stacks. Must be called after packed_stacks is changed directly
+        """
+        metadata = [get_stack_metadata(stack) for stack in self.packed_stacks]
+
+        self.run_lengths = tuple(run_length for run_length, _, _ in metadata)
+        self.tops = tuple(top for _, _, top in metadata)
+        self.prefix_mask = 0
+        for i in STACK_RANGE:
+            if metadata[i][1]:
+                self.prefix_mask |= 1 << i
 
     def get_legal_actions(self, allow_cheats):
         """
@@ -105,94 +193,69 @@ class GameState:
             stack_size being the current size of the target stack (for replaying the actions accurately)
         """
         actions = []
+        stacks = self.packed_stacks
+        cheat_mask = self.cheat_mask
+        tops = self.tops
+        prefix_mask = self.prefix_mask
+
+        # Stacks that can be moved onto: not finished and not cheated
+        targets = [
+            i for i in STACK_RANGE if stacks[i] is not None and not cheat_mask & (1 << i)
+        ]
+        empty_stack_index = self.get_empty_stack()
 
         # Loop through all stacks, and list out all legal actions
         for stack_index in STACK_RANGE:
-            stack = self.stacks[stack_index]
+            stack = stacks[stack_index]
 
-            if stack is None:
+            if not stack:
                 continue
 
-            # Check for being able to collapse the stack (a top slice of it)
-            can_collapse = True
-            collapse_check_value = 6
+            # Only the descending run on top of the stack can be moved, or only the topmost card if it's cheated
+            stack_cheated = cheat_mask & (1 << stack_index)
+            top_index = len(stack) - 1
+            movable = 1 if stack_cheated else self.run_lengths[stack_index]
+            top_is_six = tops[stack_index] == 6
 
-            for card_index in range(len(stack))[::-1]:
+            for card_index in range(top_index, top_index - movable, -1):
                 card = stack[card_index]
 
-                # Early exit conditions for cards that are not the topmost
-                if card_index < len(stack) - 1:
-                    # If the value of the card is not +1 of the value on top of it, break from this stack loop
-                    # (no cards below can be moved either)
-                    if stack[card_index + 1] + 1 != stack[card_index]:
-                        break
-
-                    # Any card below a cheated card cannot be moved, break
-                    if self.cheats[stack_index] == True:
-                        break
-
-                # Check for collapsing
-                if collapse_check_value == card and can_collapse:
-                    collapse_check_value += 1
-                    if card == 14:  # Add a collapse action, if there is a free slow
-                        can_collapse = False
-                        empty_stack_index = self.get_empty_stack()
-                        if empty_stack_index >= 0:
-                            actions.append((
-                                (stack_index, card_index), (False,
-                                                            True, empty_stack_index, 0)
-                            ))
-                else:
-                    can_collapse = False
+                # A run from 14 to 6 can be collapsed into a free slot
+                if card == 14 and top_is_six and empty_stack_index >= 0:
+                    actions.append((
+                        (stack_index, card_index), (False,
+                                                    True, empty_stack_index, 0)
+                    ))
 
                 # Check if the card can be placed onto any other stack
-                for target_stack_index in STACK_RANGE:
+                for target_stack_index in targets:
                     # Can not move onto the same stack (legal nor cheating)
                     if stack_index == target_stack_index:
                         continue
 
-                    # Can not move onto a finished stack (legal nor cheating)
-                    if self.stacks[target_stack_index] is None:
-                        continue
-
-                    # Can not move onto a cheated stack
-                    if self.cheats[target_stack_index]:
-                        continue
+                    target_top = tops[target_stack_index]
 
-                    if self.can_place(card, target_stack_index):
-                        # Check if the action will perform a collapse
-                        # Check that the target stack supports it - must start from 14 at the bottom and end somewhere
-                        # before 6
-                        target_card_value = 14
-                        for i in self.stacks[target_stack_index]:
-                            if i == target_card_value:
-                                target_card_value -= 1
-                            else:
-                                target_card_value = -1
-
-                        # Target stack supports collapse - now check the source stack
-                        for i in range(len(self.stacks[stack_index])):
-                            if i < card_index:
-                                continue
-                            if self.stacks[stack_index][i] == target_card_value:
-                                target_card_value -= 1
-
-                        # The action will perform a collapse if the above checks result in a target_card_value of 5
-                        action_is_collapse = target_card_value == 5
+                    if target_top == card + 1 or target_top == 0:
+                        # The action will perform a collapse if the target stack is a run starting from 14 at the
+                        # bottom and the moved cards complete it down to 6
+                        action_is_collapse = (
+                            top_is_six
+                            and prefix_mask & (1 << target_stack_index)
+                            and (target_top != 0 or card == 14)
+                        )
 
                         actions.append((
                             (stack_index, card_index), (False,
-                                                        action_is_collapse, target_stack_index, len(self.stacks[target_stack_index]))
+                                                        bool(action_is_collapse), target_stack_index, len(stacks[target_stack_index]))
                         ))
                     else:
                         # Check for cheat moves (only for other stacks that have cards and where we cannot normally move)
                         # Can only cheat the topmost card
                         # Can not re-cheat a cheated card
-                        if allow_cheats and card_index == len(stack) - 1 and not self.cheats[stack_index]:
+                        if allow_cheats and card_index == top_index and not stack_cheated:
                             actions.append((
                                 (stack_index, card_index), (True,
-                                                            False, target_stack_index, len(
-                                                                self.stacks[target_stack_index]))
+                                                            False, target_stack_index, len(stacks[target_stack_index]))
                             ))
 
         return actions
@@ -201,13 +264,13 @@ class GameState:
         """
             Returns true if the given card can be placed onto the given stack (legally)
         """
+        target_stack = self.packed_stacks[stack_index]
 
         # Can always place on empty stack
-        if len(self.stacks[stack_index]) == 0:
+        if len(target_stack) == 0:
             return True
 
-        target_card = self.stacks[stack_index][-1]
-        return target_card == card + 1
+        return target_stack[-1] == card + 1
 
     def apply_action(self, action):
         """
@@ -226,78 +289,253 @@ class GameState:
         to_collapsing = action_to[1]
         to_stack_index = action_to[2]
 
-        cards_to_pull = len(
-            self.stacks[from_stack_index]) - from_card_index
-        cards = self.pull_from_stack(from_stack_index, cards_to_pull)
+        stacks = list(self.packed_stacks)
+        run_lengths = list(self.run_lengths)
+        tops = list(self.tops)
+        prefix_mask = self.prefix_mask
+
+        source = stacks[from_stack_index]
+        cards = source[from_card_index:]
+        source = source[:from_card_index]
+        stacks[from_stack_index] = source
+
+        # Update the metadata of the source stack. If only a part of the top run was moved, the rest of it remains
+        cards_pulled = len(cards)
+        if cards_pulled < run_lengths[from_stack_index]:
+            run_lengths[from_stack_index] -= cards_pulled
+            tops[from_stack_index] = source[-1]
+        else:
+            run_lengths[from_stack_index], is_prefix, tops[from_stack_index] = get_stack_metadata(source)
+            if is_prefix:
+                prefix_mask |= 1 << from_stack_index
 
+        # Update the target stack and its metadata
         if to_collapsing:
-            self.stacks[to_stack_index] = None
+            stacks[to_stack_index] = None
+            run_lengths[to_stack_index] = 0
+            tops[to_stack_index] = 0
+            prefix_mask &= ~(1 << to_stack_index)
+        elif to_cheat_state:
+            # A cheated card never continues the run below it
+            stacks[to_stack_index] += cards
+            run_lengths[to_stack_index] = 1
+            tops[to_stack_index] = cards[-1]
+            prefix_mask &= ~(1 << to_stack_index)
         else:
-            self.stacks[to_stack_index] += cards
+            if stacks[to_stack_index]:
+                run_lengths[to_stack_index] += cards_pulled
+            else:
+                run_lengths[to_stack_index] = cards_pulled
+                if cards[0] != 14:
+                    prefix_mask &= ~(1 << to_stack_index)
+            stacks[to_stack_index] += cards
+            tops[to_stack_index] = cards[-1]
+
+        self.packed_stacks = tuple(stacks)
+        self.run_lengths = tuple(run_lengths)
+        self.tops = tuple(tops)
+        self.prefix_mask = prefix_mask
 
         # Set the cheat state of the topmost card. Has a real effect only if moving a cheat card
-        self.cheats[to_stack_index] = to_cheat_state
         # If moving a cheated card to a valid position, un-cheat that stack
-        if self.cheats[from_stack_index]:
-            self.cheats[from_stack_index] = False
+        cheat_mask = self.cheat_mask & ~(1 << to_stack_index) & ~(1 << from_stack_index)
+        if to_cheat_state:
+            cheat_mask |= 1 << to_stack_index
+        self.cheat_mask = cheat_mask
 
     def get_heuristic_value(self):
         """
             Returns a heuristic value for choosing a state over another
         """
+        weights = HEURISTIC_WEIGHTS
         score = 0
 
         # Completed stacks is very good
         # Empty slots is good
-        for stack in self.stacks:
+        # High stacks is good (consecutive cards)
+        for index, stack in enumerate(self.packed_stacks):
             if stack is None:
-                score += 50
+                score += weights["collapsed_stack"]
             elif len(stack) == 0:
-                score += 10
+                score += weights["empty_stack"]
+            else:
+                if len(stack) > HEURISTIC_BASE_HEIGHT:
+                    score += (len(stack) - HEURISTIC_BASE_HEIGHT) * weights["stack_height"]
+                if self.prefix_mask & (1 << index):
+                    score += weights["prefix_stack"]
 
-        # High stacks is good (consecutive cards)
-        for stack in self.stacks:
-            if stack is not None and len(stack) > 5:
-                score += (len(stack) - 5) * 2
+        score += sum(self.run_lengths) * weights["run_length"]
 
         # Lots of cheated cards is bad
-
-        score -= sum(self.cheats) * 15
+        score += bin(self.cheat_mask).count("1") * weights["cheat"]
 
         return score
 
+    def is_valid_deal(self):
+        """
+            Returns True if the state is a complete initial deal: every stack has INITIAL_STACK_SIZE cards
+            and there are CARD_COPIES cards of each value
+        """
+        if self.cheat_mask or any(
+            stack is None or len(stack) != INITIAL_STACK_SIZE for stack in self.packed_stacks
+        ):
+            return False
+
+        cards = b"".join(self.packed_stacks)
+        return all(cards.count(value) == CARD_COPIES for value in CARD_VALUES)
+
+    def get_distance_estimate(self):
+        """
+            Returns a lower bound for the number of actions needed to win from this state
+            Every pair of adjacent cards that is not descending by one has to be separated by moving the upper card,
+            and every stack still to be collapsed needs an action of its own. A single action separates at most one
+            such pair and collapses at most one stack
+        """
+        breaks = 0
+        collapsed = 0
+        for stack in self.packed_stacks:
+            if stack is None:
+                collapsed += 1
+                continue
+            for i in range(len(stack) - 1):
+                if stack[i] != stack[i + 1] + 1:
+                    breaks += 1
+
+        # 36 cards form 4 collapsed stacks when won
+        return max(breaks, 4 - collapsed)
+
     def get_empty_stack(self):
         """
             Returns the index of a stack that is empty, or -1 if none are.
         """
         for i in STACK_RANGE:
-            if self.stacks[i] is not None and len(self.stacks[i]) == 0:
+            if self.packed_stacks[i] == EMPTY_STACK:
                 return i
 
         return -1
 
-    def __eq__(self, other):
+    def key(self):
+        """
+            Returns a hashable key that uniquely identifies the state, including the cheat flags
+        """
+        return (self.packed_stacks, self.cheat_mask)
+
+    def get_canonical_encodings(self):
+        """
+            Returns a list of the stacks encoded as bytes, with the cheat flag appended to the cards
+            of a cheated stack and finished stacks encoded as CANONICAL_COLLAPSED
+        """
+        encodings = []
         for i in STACK_RANGE:
-            if self.stacks[i] != other.stacks[i]:
-                return False
+            stack = self.packed_stacks[i]
+            if stack is None:
+                encodings.append(CANONICAL_COLLAPSED)
+            elif self.cheat_mask & (1 << i):
+                encodings.append(stack + CANONICAL_CHEAT)
+            else:
+                encodings.append(stack)
 
-        return True
+        return encodings
+
+    def canonical_key(self):
+        """
+            Returns a key that is the same for all states that differ only by the order of the stacks
+            The stacks are sorted together with their cheat flags, so the key still tells cheated stacks apart
+        """
+        return CANONICAL_SEPARATOR.join(sorted(self.get_canonical_encodings()))
+
+    def canonical_form(self):
+        """
+            Returns a 2-tuple (key, permutation) with the canonical key of the state and the permutation
+            used to sort the stacks: permutation[i] is the index of the stack at position i of the key
+            Actions found for the canonical ordering can be mapped back with remap_action(action, permutation)
+        """
+        encodings = self.get_canonical_encodings()
+        permutation = tuple(sorted(STACK_RANGE, key=encodings.__getitem__))
+        return CANONICAL_SEPARATOR.join([encodings[i] for i in permutation]), permutation
+
+    def __eq__(self, other):
+        return self.packed_stacks == other.packed_stacks and self.cheat_mask == other.cheat_mask
 
     def hash_string(self):
         stacks_hash = "-".join([",".join([str(y) for y in x])
                                 if (x is not None and len(x) > 0)
                                 else("C" if x is None else "E")
-                                for x in self.stacks])
+                                for x in self.packed_stacks])
         cheats_hash = "".join("C" if x else "L" for x in self.cheats)
         return stacks_hash + "-" + cheats_hash
 
     def __hash__(self):
-        return hash(self.hash_string())
+        return hash(self.key())
 
     def __str__(self):
+        stacks = self.stacks
+        cheats = self.cheats
         return ("Board:\n" +
                 "\n".join([", ".join(
-                    map(lambda slot: str(slot), self.stacks[stack_index])) + (" C" if self.cheats[stack_index] else "")
-                    if self.stacks[stack_index] is not None else "COLLAPSED"
+                    map(lambda slot: str(slot), stacks[stack_index])) + (" C" if cheats[stack_index] else "")
+                    if stacks[stack_index] is not None else "COLLAPSED"
                     for stack_index in STACK_RANGE]
                 ))
+
+
+def get_stack_metadata(stack):
+    """
+        Returns the metadata of the given packed stack as a 3-tuple:
+            (run_length, is_prefix, top)
+        with run_length being the length of the descending run on top of the stack,
+        is_prefix being True if the stack can still be completed into a collapse (empty or starts from 14), and
+        top being the value of the topmost card. Empty and finished stacks have a run length and top of 0
+    """
+    if not stack:
+        return 0, stack is not None, 0
+
+    run_length = 1
+    card_index = len(stack) - 1
+    while card_index > 0 and stack[card_index - 1] == stack[card_index] + 1:
+        run_length += 1
+        card_index -= 1
+
+    return run_length, COLLAPSE_RUN.startswith(stack), stack[-1]
+
+
+def get_heuristic_weights():
+    """
+        Returns a copy of the weights used by GameState.get_heuristic_value
+    """
+    return dict(HEURISTIC_WEIGHTS)
+
+
+def set_heuristic_weights(weights):
+    """
+        Replaces the weights used by GameState.get_heuristic_value with the given ones, weights that are not
+        given keep their value. Raises ValueError on an unknown weight
+    """
+    for name in weights:
+        if name not in HEURISTIC_WEIGHTS:
+            raise ValueError("Unknown heuristic weight: {}".format(name))
+
+    HEURISTIC_WEIGHTS.update(weights)
+
+
+def remap_action(action, stack_map):
+    """
+        Returns the given action with its stack indices mapped through stack_map, where stack_map[i]
+        is the new index of stack i
+    """
+    action_from = action[0]
+    action_to = action[1]
+    return (
+        (stack_map[action_from[0]], action_from[1]),
+        (action_to[0], action_to[1], stack_map[action_to[2]], action_to[3]),
+    )
+
+
+def invert_permutation(permutation):
+    """
+        Returns the inverse of the given permutation of stack indices
+    """
+    inverse = [0] * len(permutation)
+    for i, stack_index in enumerate(permutation):
+        inverse[stack_index] = i
+    return tuple(inverse)
@@ -0,0 +1,113 @@
+from game_state import STACK_RANGE
+
+# Most primitive actions in a single macro action
+MACRO_MAX_LENGTH = 4
+
+
+class MacroAction(tuple):
+    """
+    Sequence of primitive actions that the search takes as a single action, a tuple of the actions in order
+    Every macro action found by get_macro_actions ends with a collapse
+    """
+
+    __slots__ = ()
+
+
+def get_macro_actions(state, max_length=MACRO_MAX_LENGTH):
+    """
+    Returns the macro actions of the state: the sequences of up to max_length actions that build a run
+    from 14 down to 6 and collapse it, which a search would otherwise have to find one action at a time
+    A run is built on a stack that already starts from 14 or in an empty stack a run starting from 14 is moved
+    to. Each action puts the next card onto the run, or uncovers the next card by moving the cards above it
+    elsewhere. The next card can also be a cheated card, which is freed by the move. None of the actions cheat
+    Single collapsing actions are not included, they are among the legal actions already
+    """
+    macros = []
+    stacks = state.packed_stacks
+    max_length = min(max_length, MACRO_MAX_LENGTH)
+    if max_length < 2:
+        return macros
+
+    # Shared by the runs already started in the state
+    legal_actions = state.get_legal_actions(False)
+
+    for target_index in STACK_RANGE:
+        if stacks[target_index] and state.prefix_mask & (1 << target_index):
+            collect_macro_actions(state, target_index, [], max_length, macros, legal_actions)
+
+    for action in legal_actions:
+        (from_index, card_index), (_, collapse, to_index, _) = action
+        # Moving a run that already starts the stack it's in would only swap the stacks
+        if stacks[to_index] or collapse or card_index == 0 or stacks[from_index][card_index] != 14:
+            continue
+
+        clone = state.clone()
+        clone.apply_action(action)
+        collect_macro_actions(clone, to_index, [action], max_length, macros)
+
+    return macros
+
+
+def collect_macro_actions(state, target_index, actions, max_length, macros, legal_actions=None):
+    """
+    Adds the macro actions continuing the given actions to complete the run on the stack at target_index
+    within max_length actions, see get_macro_actions
+    The legal actions of the state without cheats are generated if not given
+    """
+    if len(actions) >= max_length:
+        return
+    if legal_actions is None:
+        legal_actions = state.get_legal_actions(False)
+
+    stacks = state.packed_stacks
+    next_card = state.tops[target_index] - 1
+
+    for action in legal_actions:
+        (from_index, card_index), (_, collapse, to_index, _) = action
+
+        if to_index == target_index:
+            if collapse and not actions:
+                continue
+        elif collapse or card_index == 0 or stacks[from_index][card_index - 1] != next_card:
+            # Only the moves uncovering the next card of the run are of any use
+            continue
+
+        sequence = actions + [action]
+        if collapse:
+            macros.append(MacroAction(sequence))
+            continue
+
+        clone = state.clone()
+        clone.apply_action(action)
+        collect_macro_actions(clone, target_index, sequence, max_length, macros)
+
+
+def apply_search_action(state, action):
+    """
+    Applies a primitive action or a MacroAction to the state
+    """
+    if type(action) is MacroAction:
+        for macro_step in action:
+            state.apply_action(macro_step)
+    else:
+        state.apply_action(action)
+
+
+def get_action_length(action):
+    """
+    Returns the number of primitive actions in a primitive action or a MacroAction
+    """
+    return len(action) if type(action) is MacroAction else 1
+
+
+def expand_actions(actions):
+    """
+    Returns the given actions with every MacroAction replaced by the primitive actions it's made of
+    """
+    expanded = []
+    for action in actions:
+        if type(action) is MacroAction:
+            expanded.extend(action)
+        else:
+            expanded.append(action)
+    return expanded
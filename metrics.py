@@ -0,0 +1,215 @@
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import time
+
+from game_state import GameState
+from search import SearchStats
+
+# Phases of a game timed by the pipeline and solver.py, logged as the CSV columns along with SEARCH_PHASES
+GAME_PHASES = ("start", "capture", "parse", "solve", "search", "optimize", "replay")
+# GameState methods timed in each phase of the search by instrument_search
+SEARCH_PHASES = {
+    "move_generation": ("get_legal_actions",),
+    "cloning": ("clone",),
+    "applying": ("apply_action",),
+    "hashing": ("canonical_key",),
+    "heuristic": ("get_heuristic_value", "get_distance_estimate"),
+}
+
+
+class GameMetrics:
+    """
+    Metrics of a single game
+    timers hold the seconds spent in each phase of the game (e.g. capture, parse, solve, replay) and of the
+    search (see SEARCH_PHASES), calls the number of times each phase was entered, and search the statistics
+    and result of the search
+    """
+
+    def __init__(self, game, profile_path=None):
+        self.game = game
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.timers = {}
+        self.calls = {}
+        self.search = {}
+        # File the profile of the search is written to, None to not profile
+        self.profile_path = profile_path
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the block as the given phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def add_search_result(self, result):
+        """
+        Records the statistics and the result of a search
+        """
+        self.search = result.stats.as_dict()
+        self.search["engine"] = result.engine
+        self.search["solved"] = result.solved
+        self.search["length"] = len(result.actions)
+
+    def as_dict(self):
+        return {
+            "game": self.game,
+            "started": self.started,
+            "timers": dict(self.timers),
+            "calls": dict(self.calls),
+            "search": dict(self.search),
+        }
+
+
+class MetricsLog:
+    """
+    Writes the metrics of each game as a line into a log file, a CSV file if the path ends with .csv and
+    JSON lines otherwise. Without a path nothing is written, which is useful for only profiling the searches
+    With a profile directory, the search of each game is profiled with cProfile into a file in it
+    """
+
+    def __init__(self, path=None, profile_directory=None):
+        self.path = path
+        self.profile_directory = profile_directory
+        self.games = 0
+
+        self.log_file = open(path, "a", newline="") if path else None
+        self.csv_writer = None
+
+        if profile_directory:
+            os.makedirs(profile_directory, exist_ok=True)
+
+    def create_metrics(self):
+        """
+        Returns a GameMetrics for the next game
+        """
+        self.games += 1
+        profile_path = None
+        if self.profile_directory:
+            profile_path = os.path.join(self.profile_directory, "game_{}.prof".format(self.games))
+        return GameMetrics(self.games, profile_path)
+
+    def write(self, metrics):
+        if self.log_file is None:
+            return
+
+        if self.path.endswith(".csv"):
+            row = flatten(metrics.as_dict())
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(
+                    self.log_file, get_csv_columns(), extrasaction="ignore"
+                )
+                if self.log_file.tell() == 0:
+                    self.csv_writer.writeheader()
+            self.csv_writer.writerow(row)
+        else:
+            self.log_file.write(json.dumps(metrics.as_dict()) + "\n")
+
+        self.log_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+
+
+def phase(metrics, name):
+    """
+    Times the block as the given phase of the GameMetrics, does nothing if metrics is None
+    """
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.phase(name)
+
+
+@contextlib.contextmanager
+def instrument_search(metrics):
+    """
+    Times the GameState methods of SEARCH_PHASES into the GameMetrics while the block runs
+    The methods are wrapped only for the duration of the block, so searches outside of it run at full speed
+    Calls from other threads during the block are timed as well, searches in other processes are not
+    """
+    originals = {}
+    for phase_name, method_names in SEARCH_PHASES.items():
+        for method_name in method_names:
+            original = GameState.__dict__[method_name]
+            originals[method_name] = original
+            setattr(GameState, method_name, timed(original, phase_name, metrics))
+
+    try:
+        yield
+    finally:
+        for method_name, original in originals.items():
+            setattr(GameState, method_name, original)
+
+
+@contextlib.contextmanager
+def profile_search(metrics):
+    """
+    Profiles the block with cProfile into metrics.profile_path, does nothing without a profile path
+    """
+    if metrics is None or metrics.profile_path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(metrics.profile_path)
+
+
+def timed(function, phase_name, metrics):
+    """
+    Returns a wrapper of the function adding the time of each call to the given phase
+    """
+    perf_counter = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics.add_time(phase_name, perf_counter() - start)
+
+    return wrapper
+
+
+def get_csv_columns():
+    """
+    Returns the columns of the CSV log
+    """
+    phases = GAME_PHASES + tuple(SEARCH_PHASES)
+    search_values = list(SearchStats().as_dict()) + ["engine", "solved", "length"]
+    return (
+        ["game", "started"]
+        + ["timers." + name for name in phases]
+        + ["calls." + name for name in phases]
+        + ["search." + name for name in search_values]
+    )
+
+
+def flatten(values, prefix=""):
+    """
+    Flattens nested dictionaries into a single dictionary with keys joined by dots
+    """
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
@@ -0,0 +1,86 @@
+from search import SearchContext, run_search
+
+# Tail search parameters
+# Number of actions between the states of the solution the rest of the solution is searched again from
+TAIL_SEARCH_INTERVAL = 10
+# Bounded weighted A* search, like the plan improvement of pipeline.py
+TAIL_SEARCH_ENGINE = "astar"
+TAIL_SEARCH_WEIGHT = 1.5
+# Number of states searched from each of those states
+TAIL_SEARCH_STATES = 5000
+
+
+def optimize_actions(state, actions, allow_cheats=True):
+    """
+    Shortens a solution before it is replayed
+    Cycles in the solution (e.g. a move and its undo) are cut out first, then the rest of the solution is
+    searched again every TAIL_SEARCH_INTERVAL actions for a shorter way to win
+    Returns the shortened list of actions, leading from the given state to the won state
+    """
+    actions, states = remove_cycles(state, actions)
+
+    i = 0
+    while i < len(actions) - 1:
+        tail_actions = find_shorter_tail(states[i], len(actions) - i, allow_cheats)
+
+        if tail_actions is not None:
+            actions = actions[:i] + tail_actions
+            del states[i + 1 :]
+            for action in tail_actions:
+                next_state = states[-1].clone()
+                next_state.apply_action(action)
+                states.append(next_state)
+
+        i += TAIL_SEARCH_INTERVAL
+
+    return actions
+
+
+def remove_cycles(state, actions):
+    """
+    Removes the actions between two visits of the same state
+    Returns a 2-tuple (actions, states) with the remaining actions and the states along them, starting with
+    the given state
+    """
+    kept_actions = []
+    states = [state.clone()]
+    # Index of each state in the states list
+    visited = {state.key(): 0}
+
+    for action in actions:
+        next_state = states[-1].clone()
+        next_state.apply_action(action)
+        key = next_state.key()
+
+        if key in visited:
+            # Back to an earlier state, drop everything after it
+            index = visited[key]
+            for dropped_state in states[index + 1 :]:
+                del visited[dropped_state.key()]
+            del states[index + 1 :]
+            del kept_actions[index:]
+        else:
+            kept_actions.append(action)
+            states.append(next_state)
+            visited[key] = len(states) - 1
+
+    return kept_actions, states
+
+
+def find_shorter_tail(state, length, allow_cheats=True):
+    """
+    Searches for a way to win from the state of the solution in fewer than length actions, the number of
+    actions the solution takes from it
+    Returns the actions of the shorter way, or None if none was found within TAIL_SEARCH_STATES states
+    """
+    context = SearchContext(
+        allow_cheats=allow_cheats,
+        max_states=TAIL_SEARCH_STATES,
+        max_solution_length=length - 1,
+        weight=TAIL_SEARCH_WEIGHT,
+    )
+    result = run_search(TAIL_SEARCH_ENGINE, state, context)
+
+    if not result.solved or len(result.actions) >= length:
+        return None
+    return result.actions
@@ -0,0 +1,173 @@
+import multiprocessing
+import time
+
+from game_state import get_heuristic_weights, set_heuristic_weights
+from search import SearchContext, SearchNode, SearchResult, SearchStats, run_search
+from transposition import SharedTranspositionTable
+
+# Number of branches created per worker, more branches balance the work better between the workers
+BRANCHES_PER_WORKER = 4
+
+# Engines that read and write the transposition table of the search context, which the workers share. The ida
+# engine clears its table between iterations, inplace and external keep their own, so each worker would run a
+# separate search
+PARALLEL_ENGINES = ("greedy", "astar", "beam")
+
+# Shared structures of a worker process, set by init_worker
+worker_table = None
+worker_stop_event = None
+
+
+def parallel_search(engine, state, workers, table_size, **context_options):
+    """
+    Solves the given state with the given search engine using a pool of worker processes
+    The search tree is split into branches near the root and each branch is searched by a worker. The workers
+    share a transposition table, and the first solution found stops the other workers
+    Returns a SearchResult with the statistics summed over all workers
+    Raises ValueError for an engine that can't share the table, see PARALLEL_ENGINES
+    """
+    if engine not in PARALLEL_ENGINES:
+        raise ValueError(
+            "The {} engine can't be split between workers, use one of: {}".format(
+                engine, ", ".join(PARALLEL_ENGINES)
+            )
+        )
+
+    start_time = time.perf_counter()
+    allow_cheats = context_options.get("allow_cheats", True)
+
+    stats = SearchStats()
+    branches = split_search(state, allow_cheats, workers * BRANCHES_PER_WORKER, stats)
+    name = "{} ({} workers)".format(engine, workers)
+
+    # The state may be solved while splitting
+    for node in branches:
+        if node.state.is_won():
+            stats.elapsed = time.perf_counter() - start_time
+            return SearchResult(name, True, node.get_actions(), stats)
+
+    table = SharedTranspositionTable(table_size)
+    stop_event = multiprocessing.Event()
+
+    # Split the state budget so that every worker searches about as many states as a single search would
+    branch_options = dict(context_options)
+    if "max_states" in context_options:
+        branch_options["max_states"] = max(
+            1, context_options["max_states"] * workers // len(branches)
+        )
+
+    tasks = [
+        (engine, node.state, node.get_actions(), branch_options) for node in branches
+    ]
+
+    result = None
+    best_actions = []
+    highest_heuristic = -999
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(table_size, table.slots, stop_event, get_heuristic_weights()),
+    ) as pool:
+        for branch_result in pool.imap_unordered(search_branch, tasks):
+            merge_stats(stats, branch_result.stats)
+
+            if branch_result.solved:
+                # Stop the other workers, the pool is terminated when leaving the with block
+                stop_event.set()
+                result = branch_result
+                break
+
+            # Keep the partial solution reaching the highest heuristic score
+            final_state = state.clone()
+            for action in branch_result.actions:
+                final_state.apply_action(action)
+            heuristic_score = final_state.get_heuristic_value()
+            if heuristic_score >= highest_heuristic:
+                highest_heuristic = heuristic_score
+                best_actions = branch_result.actions
+
+    stats.elapsed = time.perf_counter() - start_time
+    if result is not None:
+        return SearchResult(name, True, result.actions, stats)
+    return SearchResult(name, False, best_actions, stats)
+
+
+def split_search(state, allow_cheats, count, stats):
+    """
+    Expands the given state breadth-first until there are at least count distinct states to search
+    Returns the nodes of the last expanded layer, the most promising ones (highest heuristic score) first
+    """
+    nodes = [SearchNode(state)]
+    seen = {state.canonical_key()}
+
+    while len(nodes) < count:
+        children = []
+        for node in nodes:
+            if node.state.is_won():
+                return [node]
+
+            stats.states_expanded += 1
+            for action in node.state.get_legal_actions(allow_cheats):
+                clone = node.state.clone()
+                clone.apply_action(action)
+
+                key = clone.canonical_key()
+                if key in seen:
+                    stats.duplicates_pruned += 1
+                    continue
+                seen.add(key)
+
+                children.append(SearchNode(clone, node, action))
+                stats.states_searched += 1
+
+        if len(children) == 0:
+            break
+        nodes = children
+
+    nodes.sort(key=lambda node: node.state.get_heuristic_value(), reverse=True)
+    return nodes
+
+
+def init_worker(table_size, table_slots, stop_event, heuristic_weights):
+    """
+    Sets up the shared structures of a worker process
+    The heuristic weights are passed on, as a spawned worker would start with the default ones
+    """
+    global worker_table
+    global worker_stop_event
+
+    worker_table = SharedTranspositionTable(table_size, table_slots)
+    worker_stop_event = stop_event
+    set_heuristic_weights(heuristic_weights)
+
+
+def search_branch(task):
+    """
+    Searches a single branch in a worker process
+    Returns a SearchResult with actions starting from the root of the whole search
+    """
+    engine, state, actions, context_options = task
+
+    context = SearchContext(**context_options)
+    context.table = worker_table
+    context.should_stop = worker_stop_event.is_set
+
+    # Account for the actions taken before the branch
+    context.max_solution_length -= len(actions)
+
+    result = run_search(engine, state, context)
+    result.actions = actions + result.actions
+    return result
+
+
+def merge_stats(stats, other):
+    """
+    Adds the statistics of a worker to the given statistics
+    """
+    stats.states_searched += other.states_searched
+    stats.states_expanded += other.states_expanded
+    stats.duplicates_pruned += other.duplicates_pruned
+    stats.states_pruned += other.states_pruned
+    stats.frontier_peak = max(stats.frontier_peak, other.frontier_peak)
+    stats.iterations = max(stats.iterations, other.iterations)
@@ -0,0 +1,265 @@
+import queue
+import threading
+import time
+
+from metrics import phase
+from search import SearchContext, run_search
+
+# Plan improvement parameters
+# Number of actions ahead of the replay the improved part of the plan starts at, so that the replay does not reach
+# it while the search is running
+PLAN_LOOKAHEAD = 3
+# Search engine, its options and the number of states searched per attempt to shorten the rest of the plan
+PLAN_IMPROVEMENT_ENGINE = "astar"
+PLAN_IMPROVEMENT_WEIGHT = 1.5
+PLAN_IMPROVEMENT_STATES = 5000
+PLAN_IMPROVEMENT_ATTEMPTS = 3
+
+
+class ReplayPlan:
+    """
+    Actions of a single game shared between the solve and the replay stages
+    state is the GameState of the board the actions start from
+    The replay stage takes the actions from the front, while the solve stage may replace the actions that
+    have not been taken yet with a shorter sequence
+    """
+
+    def __init__(self, state, actions, solved):
+        self.lock = threading.Lock()
+        self.state = state
+        self.actions = list(actions)
+        self.solved = solved
+
+        # Number of actions taken by the replay stage
+        self.position = 0
+
+    def take_next(self):
+        """
+        Returns the next action to replay, or None if all actions have been taken
+        """
+        with self.lock:
+            if self.position >= len(self.actions):
+                return None
+            action = self.actions[self.position]
+            self.position += 1
+            return action
+
+    def snapshot(self):
+        """
+        Returns a 2-tuple (position, actions) with the number of actions taken and a copy of all actions
+        """
+        with self.lock:
+            return self.position, list(self.actions)
+
+    def replace_suffix(self, start, actions):
+        """
+        Replaces the actions from index start onwards with the given actions
+        Returns False without changing the plan if the replay has already taken the action at start
+        """
+        with self.lock:
+            if start < self.position:
+                return False
+            self.actions[start:] = actions
+            return True
+
+
+class GamePipeline:
+    """
+    Plays games with the capture, solve and replay stages running on their own threads
+
+    The capture stage starts a new game and reads the board as soon as the previous game has been replayed,
+    the solve stage searches for a solution and hands it over to the replay stage right away, and keeps verifying
+    and shortening the rest of the plan while the replay stage plays the actions on the board
+
+    The stages are given as callables:
+        start_game(metrics) returns the GameState of a new game, or None if the board could not be read
+        solve_game(state, metrics) returns a SearchResult
+        improve_plan(state, plan) verifies and shortens the ReplayPlan while it is being replayed
+        replay_action(state, action) plays a single action on the board showing the given state, returns False
+            if the board is out of sync with the expected state
+    metrics is the GameMetrics of the game if a MetricsLog is given, otherwise None. The metrics of each game
+    are written to the log after its replay
+    """
+
+    def __init__(
+        self,
+        start_game,
+        solve_game,
+        improve_plan,
+        replay_action,
+        game_count,
+        post_game_delay=0,
+        metrics_log=None,
+    ):
+        self.start_game = start_game
+        self.solve_game = solve_game
+        self.improve_plan = improve_plan
+        self.replay_action = replay_action
+        self.game_count = game_count
+        self.post_game_delay = post_game_delay
+        self.metrics_log = metrics_log
+
+        self.board_queue = queue.Queue()
+        self.plan_queue = queue.Queue()
+        # Set when the board is free for starting a new game
+        self.capture_armed = threading.Event()
+        self.capture_armed.set()
+
+        self.error = None
+
+    def run(self):
+        """
+        Plays game_count games, returns when the last one has been replayed
+        """
+        threads = [
+            threading.Thread(target=self.run_stage, args=(stage,), daemon=True)
+            for stage in (self.capture_stage, self.solve_stage, self.replay_stage)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Join with a timeout so that Ctrl+C reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+
+        if self.error is not None:
+            raise self.error
+
+    def run_stage(self, stage):
+        """
+        Runs a stage, and on an error stops the other stages by closing the queues
+        """
+        try:
+            stage()
+        except Exception as error:
+            self.error = error
+            self.board_queue.put(None)
+            self.plan_queue.put(None)
+            self.capture_armed.set()
+
+    def capture_stage(self):
+        games_started = 0
+        while games_started < self.game_count:
+            # Wait until the previous game has been replayed
+            self.capture_armed.wait()
+            self.capture_armed.clear()
+            if self.error is not None:
+                return
+
+            if games_started > 0:
+                time.sleep(self.post_game_delay)
+
+            metrics = self.metrics_log.create_metrics() if self.metrics_log is not None else None
+            with phase(metrics, "start"):
+                state = self.start_game(metrics)
+            games_started += 1
+
+            if state is None:
+                # Nothing to replay, the board is free for the next game right away
+                self.capture_armed.set()
+                continue
+
+            self.board_queue.put((state, metrics))
+
+        self.board_queue.put(None)
+
+    def solve_stage(self):
+        while True:
+            game = self.board_queue.get()
+            if game is None:
+                self.plan_queue.put(None)
+                return
+
+            state, metrics = game
+            with phase(metrics, "solve"):
+                result = self.solve_game(state, metrics)
+            plan = ReplayPlan(state, result.actions, result.solved)
+            self.plan_queue.put((plan, metrics))
+
+            # Keep working on the plan while it is being replayed
+            self.improve_plan(state, plan)
+
+    def replay_stage(self):
+        while True:
+            game = self.plan_queue.get()
+            if game is None:
+                return
+
+            plan, metrics = game
+            print("Replaying", len(plan.actions), "actions", flush=True)
+            with phase(metrics, "replay"):
+                self.replay_plan(plan)
+
+            if metrics is not None:
+                self.metrics_log.write(metrics)
+
+            # The replay is over, start the next game
+            self.capture_armed.set()
+
+    def replay_plan(self, plan):
+        """
+        Replays the actions of the plan until all have been taken or the board is out of sync
+        """
+        # State the board is expected to show before each action
+        state = plan.state.clone()
+        action = plan.take_next()
+        while action is not None:
+            if not self.replay_action(state, action):
+                print("The board is out of sync, giving up on this game", flush=True)
+                return
+            state.apply_action(action)
+            action = plan.take_next()
+
+
+def improve_plan(state, plan, allow_cheats=True):
+    """
+    Verifies that every action of the plan is legal, then tries to shorten the part of the plan the replay has
+    not reached yet by searching for a shorter way to finish the game from a state a few actions ahead
+    """
+    _, actions = plan.snapshot()
+
+    # Verify the plan, cut it at the first illegal action
+    verified_state = state.clone()
+    for i, action in enumerate(actions):
+        if action not in verified_state.get_legal_actions(allow_cheats):
+            print("Action", i, "of the plan is not legal, cutting the plan", flush=True)
+            plan.replace_suffix(i, [])
+            return
+        verified_state.apply_action(action)
+
+    if not plan.solved:
+        return
+
+    for _ in range(PLAN_IMPROVEMENT_ATTEMPTS):
+        position, actions = plan.snapshot()
+        start = position + PLAN_LOOKAHEAD
+        remaining = len(actions) - start
+        if remaining <= 1:
+            return
+
+        start_state = state.clone()
+        for action in actions[:start]:
+            start_state.apply_action(action)
+
+        context = SearchContext(
+            allow_cheats=allow_cheats,
+            max_states=PLAN_IMPROVEMENT_STATES,
+            max_solution_length=remaining - 1,
+            weight=PLAN_IMPROVEMENT_WEIGHT,
+        )
+        result = run_search(PLAN_IMPROVEMENT_ENGINE, start_state, context)
+
+        if not result.solved or len(result.actions) >= remaining:
+            return
+        if not plan.replace_suffix(start, result.actions):
+            return
+
+        print(
+            "Shortened the plan from",
+            len(actions),
+            "to",
+            start + len(result.actions),
+            "actions",
+            flush=True,
+        )
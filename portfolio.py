@@ -0,0 +1,126 @@
+import multiprocessing
+import time
+
+from game_state import get_heuristic_weights, set_heuristic_weights
+from parallel import merge_stats
+from search import SearchContext, SearchResult, SearchStats, run_search
+
+# Strategies raced by portfolio_search as 3-tuples (name, engine, context options)
+# The options of a strategy override the ones given to portfolio_search
+#   no_cheats: solves the easy deals without cheating, fails fast on the rest
+#   greedy: the default engine of solver.py
+#   astar: weighted A* with cheats, solves most deals with few states
+#   deep_astar: weighted A* with a lower weight, slower but finds shorter solutions and solves some of the deals
+#               the others get lost on
+PORTFOLIO_STRATEGIES = (
+    ("no_cheats", "astar", {"allow_cheats": False}),
+    ("greedy", "greedy", {"allow_cheats": True}),
+    ("astar", "astar", {"allow_cheats": True}),
+    ("deep_astar", "astar", {"allow_cheats": True, "weight": 1.5}),
+)
+# State budget of each strategy, large enough that the deadline is what stops them
+PORTFOLIO_MAX_STATES = 10000000
+# Seconds to wait past the deadline for the strategies to return their results before terminating them
+PORTFOLIO_GRACE_TIME = 0.5
+
+# Stop event of a worker process, set by init_worker
+worker_stop_event = None
+
+
+def portfolio_search(state, time_budget, strategies=PORTFOLIO_STRATEGIES, **context_options):
+    """
+    Races the strategies on the given state in parallel processes for at most time_budget seconds
+    The first strategy to find a solution stops the others. If none finds one by the deadline, the actions
+    leading to the best state any of them reached are returned
+    The context options are used by every strategy, with allow_cheats=False no strategy cheats
+    Returns a SearchResult named after the winning strategy, with the statistics summed over all strategies
+    """
+    start_time = time.perf_counter()
+    # Compared across processes, so it's wall-clock time
+    deadline = time.time() + time_budget
+
+    tasks = []
+    for name, engine, strategy_options in strategies:
+        options = dict(context_options, max_states=PORTFOLIO_MAX_STATES)
+        options.update(strategy_options)
+        if not context_options.get("allow_cheats", True):
+            options["allow_cheats"] = False
+        tasks.append((name, engine, state, options, deadline))
+
+    stats = SearchStats()
+    stop_event = multiprocessing.Event()
+
+    result = None
+    best_result = None
+    highest_heuristic = -999
+
+    with multiprocessing.Pool(
+        len(tasks), initializer=init_worker, initargs=(stop_event, get_heuristic_weights())
+    ) as pool:
+        results = pool.imap_unordered(run_strategy, tasks)
+
+        for _ in tasks:
+            try:
+                strategy_result = results.next(
+                    max(0, deadline - time.time()) + PORTFOLIO_GRACE_TIME
+                )
+            except multiprocessing.TimeoutError:
+                # A strategy is stuck in a long expansion, the pool is terminated when leaving the with block
+                break
+
+            merge_stats(stats, strategy_result.stats)
+
+            if result is not None:
+                continue
+
+            if strategy_result.solved:
+                # Stop the other strategies, they return their results right away
+                stop_event.set()
+                result = strategy_result
+                continue
+
+            # Keep the partial solution reaching the highest heuristic score
+            final_state = state.clone()
+            for action in strategy_result.actions:
+                final_state.apply_action(action)
+            heuristic_score = final_state.get_heuristic_value()
+            if heuristic_score >= highest_heuristic:
+                highest_heuristic = heuristic_score
+                best_result = strategy_result
+        else:
+            # Let the idle workers exit, terminating a pool that is handing out tasks can deadlock
+            pool.close()
+            pool.join()
+
+    stats.elapsed = time.perf_counter() - start_time
+    if result is not None:
+        return SearchResult(result.engine, True, result.actions, stats)
+    if best_result is not None:
+        return SearchResult(best_result.engine, False, best_result.actions, stats)
+    return SearchResult("portfolio", False, [], stats)
+
+
+def init_worker(stop_event, heuristic_weights):
+    """
+    Sets up a worker process of portfolio_search
+    The heuristic weights are passed on, as a spawned worker would start with the default ones
+    """
+    global worker_stop_event
+
+    worker_stop_event = stop_event
+    set_heuristic_weights(heuristic_weights)
+
+
+def run_strategy(task):
+    """
+    Runs a single strategy until it finishes, another strategy solves the state or the deadline passes
+    Returns a SearchResult with the engine named after the strategy
+    """
+    name, engine, state, options, deadline = task
+
+    context = SearchContext(**options)
+    context.should_stop = lambda: worker_stop_event.is_set() or time.time() >= deadline
+
+    result = run_search(engine, state, context)
+    result.engine = "{} (portfolio)".format(name)
+    return result
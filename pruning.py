@@ -0,0 +1,85 @@
+from macros import MacroAction
+
+# Number of finished stacks in a won game, 36 cards in runs from 14 to 6
+WON_COLLAPSED_STACKS = 4
+
+
+# Number of cards of each packed stack that have to be moved at least once, filled by get_stack_moves
+# Most stacks are shared between many states, so each one is counted only once
+stack_moves_cache = {}
+STACK_MOVES_CACHE_SIZE = 1000000
+
+
+def get_lower_bound(state):
+    """
+    Returns a lower bound for the number of actions needed to win from the given state
+
+    A card on top of a break (a card below it that is not one higher) has to be moved before the break can go
+    away, and so does the bottom card of a stack that is not a 14, as only a stack starting from 14 can collapse
+    in place. Until it is moved, such a card stays at the bottom of every block moved from its stack, so each of
+    them needs a separate action. This includes every cheated card. Every stack still to be collapsed also needs
+    an action of its own
+    """
+    moves = 0
+    collapsed = 0
+
+    for stack in state.packed_stacks:
+        if stack is None:
+            collapsed += 1
+        else:
+            cached_moves = stack_moves_cache.get(stack)
+            moves += cached_moves if cached_moves is not None else get_stack_moves(stack)
+
+    return max(moves, WON_COLLAPSED_STACKS - collapsed)
+
+
+def get_stack_moves(stack):
+    """
+    Returns the number of cards of the packed stack that have to be moved at least once, see get_lower_bound
+    """
+    moves = 0
+    if stack and stack[0] != 14:
+        moves += 1
+    for i in range(len(stack) - 1):
+        if stack[i] != stack[i + 1] + 1:
+            moves += 1
+
+    if len(stack_moves_cache) >= STACK_MOVES_CACHE_SIZE:
+        stack_moves_cache.clear()
+    stack_moves_cache[stack] = moves
+    return moves
+
+
+def is_dead_end(state):
+    """
+    Returns True if no action is possible in the state and it is not won: every stack that is not finished has
+    a cheated card on top, so there is no empty stack and nowhere to move to
+    """
+    cheat_mask = state.cheat_mask
+    if not cheat_mask:
+        return False
+
+    for i, stack in enumerate(state.packed_stacks):
+        if stack is not None and not cheat_mask & (1 << i):
+            return False
+
+    return True
+
+
+def is_redundant_action(node, action):
+    """
+    Returns True if the action moves the same cards the action leading to the node just moved, without
+    cheating. Such an action either undoes the previous one or continues it to a stack the cards could have
+    been moved to directly, reaching the same state with fewer actions
+    A cheating action is allowed, as a card that was cheated before the previous action can't be cheated directly
+    Macro actions are never redundant, and only the last action of a macro action counts as the previous one
+    """
+    previous = node.action
+    if previous is None or type(action) is MacroAction or action[1][0]:
+        return False
+    if type(previous) is MacroAction:
+        previous = previous[-1]
+
+    # The previous action put the cards onto the target stack at the target stack's height
+    return action[0] == (previous[1][2], previous[1][3])
+
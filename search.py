@@ -0,0 +1,800 @@
+import heapq
+import tempfile
+import time
+
+from board import Board, decode_move, encode_action, is_redundant_move
+from external import NO_MOVE, ExternalLayer, get_layer_actions
+from frontier import Frontier
+from macros import apply_search_action, expand_actions, get_action_length, get_macro_actions
+from pruning import get_lower_bound, is_dead_end, is_redundant_action
+from transposition import TranspositionTable, get_fingerprint
+
+# Default limits for a single search
+MAX_STATES = 50000
+MAX_SOLUTION_LENGTH = 100
+
+# Default engine specific parameters
+DEFAULT_WEIGHT = 3.0
+DEFAULT_BEAM_WIDTH = 30
+
+
+class SearchNode:
+    """
+    Node of the search tree
+    Only the last action and a link to the parent node are stored, the full list of actions
+    leading to the node is rebuilt on demand with get_actions()
+    The action may be a MacroAction, the depth counts each of its primitive actions
+    """
+
+    __slots__ = ("state", "parent", "action", "depth")
+
+    def __init__(self, state, parent=None, action=None):
+        self.state = state
+        self.parent = parent
+        self.action = action
+        self.depth = parent.depth + get_action_length(action) if parent is not None else 0
+
+    def get_actions(self):
+        """
+        Returns the list of actions leading from the root node to this node
+        """
+        actions = []
+        node = self
+        while node.parent is not None:
+            actions.append(node.action)
+            node = node.parent
+
+        actions.reverse()
+        return expand_actions(actions)
+
+
+class SearchContext:
+    """
+    Settings and shared structures of a single search, passed to the search engines
+    """
+
+    def __init__(
+        self,
+        allow_cheats=True,
+        max_states=MAX_STATES,
+        max_solution_length=MAX_SOLUTION_LENGTH,
+        max_frontier_size=None,
+        max_table_size=None,
+        weight=DEFAULT_WEIGHT,
+        beam_width=DEFAULT_BEAM_WIDTH,
+        prune=True,
+        endgame=None,
+        macros=False,
+        external_directory=None,
+    ):
+        self.allow_cheats = allow_cheats
+        self.max_states = max_states
+        self.max_solution_length = max_solution_length
+        self.max_frontier_size = max_frontier_size
+        self.max_table_size = max_table_size
+
+        # Weight of the distance estimate in weighted A* and IDA*
+        self.weight = weight
+        # Number of states kept per layer in beam search
+        self.beam_width = beam_width
+        # Cut states that can't lead to a solution within max_solution_length and skip redundant actions,
+        # see pruning.py
+        self.prune = prune
+        # Optional endgame.EndgameDatabase, the searches cut the endgame boards that can't be won and finish
+        # the ones that can with its shortest solution. A* and IDA* use its distances as the lower bound
+        self.endgame = endgame
+        # Also search the macro actions of macros.py, sequences of actions completing a collapse taken as one
+        # action. Not used by the inplace engine
+        self.macros = macros
+        # Directory the external engine keeps its layer files in, a temporary directory in the system's default
+        # location if not set
+        self.external_directory = external_directory
+
+        self.table = TranspositionTable(max_table_size)
+        self.stats = SearchStats()
+
+        # Optional callable returning True when the search should be stopped early (e.g. another process
+        # already found a solution)
+        self.should_stop = None
+
+    def stop_requested(self):
+        """
+        Returns True if the search should be stopped early, checked by the engines before expanding a state
+        """
+        return self.should_stop is not None and self.should_stop()
+
+
+class SearchStats:
+    """
+    Statistics reported by every search engine
+    """
+
+    def __init__(self):
+        # New states generated and accepted into the search, limited by SearchContext.max_states
+        self.states_searched = 0
+        # States whose legal actions were generated
+        self.states_expanded = 0
+        # Generated states dropped because they were already reached with as few actions
+        self.duplicates_pruned = 0
+        # Actions skipped and generated states cut by the pruning rules
+        self.states_pruned = 0
+        # Largest number of states waiting to be expanded at once
+        self.frontier_peak = 0
+        # Deepening iterations of IDA*, layers of beam search
+        self.iterations = 0
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class SearchResult:
+    """
+    Result of a search
+    If no solution was found, actions lead to the state with the highest found heuristic score
+    """
+
+    def __init__(self, engine, solved, actions, stats):
+        self.engine = engine
+        self.solved = solved
+        self.actions = actions
+        self.stats = stats
+
+
+def get_search_actions(node, context):
+    """
+    Returns the actions a search takes from the state of the node: the legal actions, followed by the macro
+    actions that fit within max_solution_length if the context asks for them
+    """
+    actions = node.state.get_legal_actions(context.allow_cheats)
+    if context.macros:
+        actions.extend(get_macro_actions(node.state, context.max_solution_length - node.depth))
+    return actions
+
+
+def solve_endgame(node, context):
+    """
+    Returns the actions winning the state of the node with the endgame database of the context, None if there
+    is no database, the state is not in the endgame or it can't be won within max_solution_length
+    """
+    endgame = context.endgame
+    if endgame is None or not endgame.is_endgame(node.state.packed_stacks):
+        return None
+
+    actions = endgame.solve(node.state, context.allow_cheats)
+    if actions is None or node.depth + len(actions) > context.max_solution_length:
+        return None
+    return actions
+
+
+def is_lost_endgame(state, context):
+    """
+    Returns True if the state is in the endgame and the endgame database of the context knows it can't be won
+    """
+    endgame = context.endgame
+    return (
+        endgame is not None
+        and endgame.is_endgame(state.packed_stacks)
+        and endgame.get_distance(state, context.allow_cheats) is None
+    )
+
+
+def get_endgame_lower_bound(state, context):
+    """
+    Returns a lower bound for the number of actions needed to win the state, see pruning.get_lower_bound
+    The distance in the endgame database of the context is exact and used instead for a state in the endgame,
+    None if the state can't be won
+    """
+    endgame = context.endgame
+    if endgame is not None and endgame.is_endgame(state.packed_stacks):
+        return endgame.get_distance(state, context.allow_cheats)
+    return get_lower_bound(state)
+
+
+def greedy_search(state, context):
+    """
+    Greedy best-first search, always continuing from the state with the highest heuristic score
+    Among states with equal scores the latest generated one is continued, which makes it dive depth-first
+    """
+    stats = context.stats
+    prune = context.prune
+    table = context.table
+    frontier = Frontier(context.max_frontier_size)
+
+    root_node = SearchNode(state)
+    table.visit(state.canonical_key(), 0)
+    frontier.push(root_node, 0)
+
+    # Node with the highest found heuristic score, its actions are used if no solution is found
+    best_node = root_node
+    highest_heuristic = -999
+
+    while True:
+        if stats.states_searched > context.max_states:
+            break
+        if len(frontier) == 0:
+            break
+        if context.stop_requested():
+            break
+
+        # Take the state with the highest heuristic score, latest added first
+        current_node, _ = frontier.pop()
+        current_state = current_node.state
+
+        # End searches that run too deep
+        if current_node.depth > context.max_solution_length:
+            continue
+
+        if current_state.is_won():
+            return SearchResult("greedy", True, current_node.get_actions(), stats)
+
+        endgame_actions = solve_endgame(current_node, context)
+        if endgame_actions is not None:
+            return SearchResult("greedy", True, current_node.get_actions() + endgame_actions, stats)
+
+        stats.states_expanded += 1
+
+        for action in get_search_actions(current_node, context):
+            if prune and is_redundant_action(current_node, action):
+                stats.states_pruned += 1
+                continue
+
+            depth = current_node.depth + get_action_length(action)
+            clone = current_state.clone()
+            apply_search_action(clone, action)
+
+            # Checked here, as the state budget may end the search before the state is popped
+            if clone.is_won() and depth <= context.max_solution_length:
+                return SearchResult("greedy", True, SearchNode(clone, current_node, action).get_actions(), stats)
+
+            # Make sure we don't revisit a state, unless it was reached with fewer actions this time
+            if not table.visit(clone.canonical_key(), depth):
+                stats.duplicates_pruned += 1
+                continue
+
+            if (prune and is_dead_end(clone)) or is_lost_endgame(clone, context):
+                stats.states_pruned += 1
+                continue
+
+            heuristic_score = clone.get_heuristic_value()
+            node = SearchNode(clone, current_node, action)
+
+            if heuristic_score >= highest_heuristic:
+                highest_heuristic = heuristic_score
+                best_node = node
+
+            frontier.push(node, heuristic_score)
+            stats.states_searched += 1
+
+        stats.frontier_peak = max(stats.frontier_peak, len(frontier))
+
+    return SearchResult("greedy", False, best_node.get_actions(), stats)
+
+
+def weighted_astar_search(state, context):
+    """
+    Weighted A* search, continuing from the state with the lowest g + w * h, where g is the number of actions
+    taken and h is the lower bound of the actions still needed (see pruning.get_lower_bound)
+    With a weight of 1 the first solution found is the shortest one, higher weights find longer solutions faster
+    """
+    stats = context.stats
+    prune = context.prune
+    table = context.table
+    frontier = Frontier(context.max_frontier_size)
+    weight = context.weight
+
+    root_node = SearchNode(state)
+    table.visit(state.canonical_key(), 0)
+    # The frontier pops the highest score first, so the scores are negated
+    frontier.push(root_node, -weight * get_lower_bound(state))
+
+    best_node = root_node
+    highest_heuristic = -999
+
+    while len(frontier) > 0 and stats.states_searched <= context.max_states:
+        if context.stop_requested():
+            break
+
+        current_node, _ = frontier.pop()
+        current_state = current_node.state
+
+        if current_state.is_won():
+            return SearchResult("astar", True, current_node.get_actions(), stats)
+
+        endgame_actions = solve_endgame(current_node, context)
+        if endgame_actions is not None:
+            return SearchResult("astar", True, current_node.get_actions() + endgame_actions, stats)
+
+        # The state may have been reached with fewer actions after it was added to the frontier
+        known_depth = table.get_depth(current_state.canonical_key())
+        if known_depth is not None and current_node.depth > known_depth:
+            continue
+
+        if current_node.depth >= context.max_solution_length:
+            continue
+
+        stats.states_expanded += 1
+
+        for action in get_search_actions(current_node, context):
+            if prune and is_redundant_action(current_node, action):
+                stats.states_pruned += 1
+                continue
+
+            depth = current_node.depth + get_action_length(action)
+            clone = current_state.clone()
+            apply_search_action(clone, action)
+
+            if clone.is_won():
+                return SearchResult("astar", True, SearchNode(clone, current_node, action).get_actions(), stats)
+
+            if not table.visit(clone.canonical_key(), depth):
+                stats.duplicates_pruned += 1
+                continue
+
+            lower_bound = get_endgame_lower_bound(clone, context)
+            if lower_bound is None or (
+                prune and (depth + lower_bound > context.max_solution_length or is_dead_end(clone))
+            ):
+                stats.states_pruned += 1
+                continue
+
+            node = SearchNode(clone, current_node, action)
+
+            heuristic_score = clone.get_heuristic_value()
+            if heuristic_score >= highest_heuristic:
+                highest_heuristic = heuristic_score
+                best_node = node
+
+            frontier.push(node, -(depth + weight * lower_bound))
+            stats.states_searched += 1
+
+        stats.frontier_peak = max(stats.frontier_peak, len(frontier))
+
+    return SearchResult("astar", False, best_node.get_actions(), stats)
+
+
+def ida_star_search(state, context):
+    """
+    Iterative deepening A*: repeated depth-first searches that cut off states with g + w * h over a bound,
+    raising the bound to the lowest cut off value after each iteration
+    Uses memory only for the current path and the transposition table, which is cleared between iterations
+    """
+    stats = context.stats
+    prune = context.prune
+    weight = context.weight
+
+    root_node = SearchNode(state)
+    bound = weight * get_lower_bound(state)
+
+    best_node = root_node
+    highest_heuristic = -999
+
+    while stats.states_searched <= context.max_states:
+        stats.iterations += 1
+        next_bound = None
+        table = TranspositionTable(context.max_table_size)
+        table.visit(state.canonical_key(), 0)
+
+        # Stack of nodes still to be expanded, the children of a node are pushed in reverse order of
+        # their heuristic score so the best one is continued first
+        stack = [root_node]
+
+        while len(stack) > 0 and stats.states_searched <= context.max_states:
+            if context.stop_requested():
+                return SearchResult("ida", False, best_node.get_actions(), stats)
+
+            current_node = stack.pop()
+            current_state = current_node.state
+
+            if current_state.is_won():
+                context.table = table
+                return SearchResult("ida", True, current_node.get_actions(), stats)
+
+            endgame_actions = solve_endgame(current_node, context)
+            if endgame_actions is not None:
+                context.table = table
+                return SearchResult("ida", True, current_node.get_actions() + endgame_actions, stats)
+
+            if current_node.depth >= context.max_solution_length:
+                continue
+
+            stats.states_expanded += 1
+            children = []
+
+            for action in get_search_actions(current_node, context):
+                if prune and is_redundant_action(current_node, action):
+                    stats.states_pruned += 1
+                    continue
+
+                depth = current_node.depth + get_action_length(action)
+                clone = current_state.clone()
+                apply_search_action(clone, action)
+
+                if clone.is_won():
+                    context.table = table
+                    return SearchResult("ida", True, SearchNode(clone, current_node, action).get_actions(), stats)
+
+                lower_bound = get_endgame_lower_bound(clone, context)
+                if lower_bound is None or (
+                    prune and depth + lower_bound > context.max_solution_length
+                ):
+                    stats.states_pruned += 1
+                    continue
+
+                cost = depth + weight * lower_bound
+                if cost > bound:
+                    if next_bound is None or cost < next_bound:
+                        next_bound = cost
+                    continue
+
+                if prune and is_dead_end(clone):
+                    stats.states_pruned += 1
+                    continue
+
+                if not table.visit(clone.canonical_key(), depth):
+                    stats.duplicates_pruned += 1
+                    continue
+
+                node = SearchNode(clone, current_node, action)
+
+                heuristic_score = clone.get_heuristic_value()
+                if heuristic_score >= highest_heuristic:
+                    highest_heuristic = heuristic_score
+                    best_node = node
+
+                children.append((heuristic_score, len(children), node))
+                stats.states_searched += 1
+
+            children.sort()
+            stack.extend(child[2] for child in children)
+            stats.frontier_peak = max(stats.frontier_peak, len(stack))
+
+        # Every state within the bound was searched without a solution
+        if next_bound is None:
+            break
+        bound = next_bound
+
+    return SearchResult("ida", False, best_node.get_actions(), stats)
+
+
+def beam_search(state, context):
+    """
+    Beam search, expanding the states layer by layer and keeping only the beam_width states of each layer
+    with the lowest distance estimates, ties broken by the heuristic score
+    """
+    stats = context.stats
+    prune = context.prune
+    table = context.table
+
+    root_node = SearchNode(state)
+    table.visit(state.canonical_key(), 0)
+    layer = [root_node]
+
+    best_node = root_node
+    highest_heuristic = -999
+
+    while len(layer) > 0 and stats.states_searched <= context.max_states:
+        stats.iterations += 1
+        children = []
+
+        for current_node in layer:
+            if context.stop_requested():
+                return SearchResult("beam", False, best_node.get_actions(), stats)
+
+            current_state = current_node.state
+
+            if current_state.is_won():
+                return SearchResult("beam", True, current_node.get_actions(), stats)
+
+            endgame_actions = solve_endgame(current_node, context)
+            if endgame_actions is not None:
+                return SearchResult("beam", True, current_node.get_actions() + endgame_actions, stats)
+
+            if current_node.depth >= context.max_solution_length:
+                continue
+
+            stats.states_expanded += 1
+
+            for action in get_search_actions(current_node, context):
+                if prune and is_redundant_action(current_node, action):
+                    stats.states_pruned += 1
+                    continue
+
+                depth = current_node.depth + get_action_length(action)
+                clone = current_state.clone()
+                apply_search_action(clone, action)
+
+                if clone.is_won():
+                    return SearchResult("beam", True, SearchNode(clone, current_node, action).get_actions(), stats)
+
+                if not table.visit(clone.canonical_key(), depth):
+                    stats.duplicates_pruned += 1
+                    continue
+
+                if (prune and is_dead_end(clone)) or is_lost_endgame(clone, context):
+                    stats.states_pruned += 1
+                    continue
+
+                node = SearchNode(clone, current_node, action)
+
+                heuristic_score = clone.get_heuristic_value()
+                if heuristic_score >= highest_heuristic:
+                    highest_heuristic = heuristic_score
+                    best_node = node
+
+                children.append(
+                    (
+                        -clone.get_distance_estimate(),
+                        heuristic_score,
+                        -len(children),
+                        node,
+                    )
+                )
+                stats.states_searched += 1
+
+        stats.frontier_peak = max(stats.frontier_peak, len(children))
+        # Ties are kept in the order the states were generated
+        layer = [child[3] for child in heapq.nlargest(context.beam_width, children)]
+
+    return SearchResult("beam", False, best_node.get_actions(), stats)
+
+
+def inplace_ida_star_search(state, context):
+    """
+    IDA* like ida_star_search, searching on a single mutable Board instead of cloning a state for every action
+    Actions are encoded as integers and made on the board when the search descends, then unmade when it
+    backtracks. Children are scored and keyed by the Zobrist hash of the board without making their actions.
+    Unlike ida_star_search it doesn't search macro actions, and the endgame database is only used to finish an
+    endgame board, not as the lower bound of the states leading to one, so it searches different states and
+    reports different statistics for the same deal
+    """
+    stats = context.stats
+    prune = context.prune
+    weight = context.weight
+    allow_cheats = context.allow_cheats
+    max_solution_length = context.max_solution_length
+    endgame = context.endgame
+
+    board = Board.from_state(state)
+    if board.is_won():
+        return SearchResult("inplace", True, [], stats)
+    bound = weight * board.get_lower_bound()
+
+    best_moves = []
+    highest_heuristic = -999
+
+    while stats.states_searched <= context.max_states:
+        stats.iterations += 1
+        next_bound = None
+        table = TranspositionTable(context.max_table_size)
+        table.visit(board.hash, 0)
+
+        # Moves made on the board from the root and the heuristic scores they lead to, and for each of them
+        # (and the root) the moves of its children still to be searched and their scores, the best one last
+        path = []
+        path_scores = [board.get_heuristic_value()]
+        pending = [None]
+        pending_scores = [None]
+        expand = True
+
+        while stats.states_searched <= context.max_states:
+            if expand:
+                # Generate the children of the board, each one is evaluated without making its move
+                expand = False
+                depth = len(path) + 1
+                previous_move = path[-1] if path else None
+                board_score = path_scores[-1]
+                children = []
+                scores = []
+                stats.states_expanded += 1
+
+                for move in board.get_moves(allow_cheats):
+                    if prune and is_redundant_move(previous_move, move):
+                        stats.states_pruned += 1
+                        continue
+
+                    lower_bound = board.get_move_lower_bound(move)
+                    if prune and depth + lower_bound > max_solution_length:
+                        stats.states_pruned += 1
+                        continue
+
+                    cost = depth + weight * lower_bound
+                    if cost > bound:
+                        if next_bound is None or cost < next_bound:
+                            next_bound = cost
+                        continue
+
+                    if prune and board.is_move_dead_end(move):
+                        stats.states_pruned += 1
+                        continue
+
+                    if not table.visit(board.get_move_hash(move), depth):
+                        stats.duplicates_pruned += 1
+                        continue
+
+                    heuristic_score = board.get_move_heuristic_value(move, board_score)
+                    if heuristic_score >= highest_heuristic:
+                        highest_heuristic = heuristic_score
+                        best_moves = path + [move]
+
+                    children.append(move)
+                    scores.append(heuristic_score)
+                    stats.states_searched += 1
+
+                # Sorted by score and then by generation order, so the best and latest child is popped first
+                order = sorted(range(len(children)), key=scores.__getitem__)
+                pending[-1] = [children[i] for i in order]
+                pending_scores[-1] = [scores[i] for i in order]
+                stats.frontier_peak = max(stats.frontier_peak, len(path))
+
+            if context.stop_requested():
+                return SearchResult("inplace", False, [decode_move(move) for move in best_moves], stats)
+
+            moves = pending[-1]
+            if not moves:
+                # Every child was searched, backtrack
+                pending.pop()
+                pending_scores.pop()
+                if not path:
+                    break
+                board.unmake(path.pop())
+                path_scores.pop()
+                continue
+
+            move = moves.pop()
+            board.make(move)
+            path.append(move)
+            path_scores.append(pending_scores[-1].pop())
+            pending.append(None)
+            pending_scores.append(None)
+
+            if board.is_won():
+                return SearchResult("inplace", True, [decode_move(move) for move in path], stats)
+
+            if endgame is not None and endgame.is_endgame(board.stacks):
+                endgame_actions = endgame.solve(board.to_state(), allow_cheats)
+                if endgame_actions is not None and len(path) + len(endgame_actions) <= max_solution_length:
+                    actions = [decode_move(move) for move in path] + endgame_actions
+                    return SearchResult("inplace", True, actions, stats)
+                # Nothing to search below a board the database can't win in time
+                pending[-1] = ()
+                pending_scores[-1] = ()
+            elif len(path) >= max_solution_length:
+                pending[-1] = ()
+                pending_scores[-1] = ()
+            else:
+                expand = True
+
+        # Every state within the bound was searched without a solution
+        while path:
+            board.unmake(path.pop())
+        if next_bound is None:
+            break
+        bound = next_bound
+
+    return SearchResult("inplace", False, [decode_move(move) for move in best_moves], stats)
+
+
+def external_search(state, context):
+    """
+    Beam search like beam_search, with the layers and the visited states kept in files on disk instead of
+    memory (see external.ExternalLayer). The duplicates of a layer are detected in sorted batches once it is
+    complete, against the layer itself and all the earlier ones
+    Memory use depends only on the beam width and external.EXTERNAL_BATCH_SIZE, so with a wide beam millions of
+    states can be searched. Doesn't use the transposition table, the endgame database or macro actions
+    """
+    stats = context.stats
+    prune = context.prune
+    allow_cheats = context.allow_cheats
+
+    # The state with the highest heuristic score as its layer and fingerprint, its actions are rebuilt from the
+    # layer files if no solution is found
+    best_state = (0, 0)
+    highest_heuristic = -999
+    # Actions of the solution, once found
+    solution = None
+
+    with tempfile.TemporaryDirectory(dir=context.external_directory) as directory:
+        root_layer = ExternalLayer(directory, 0)
+        root_layer.add(get_fingerprint(state.canonical_key()), 0, NO_MOVE, state, 0, 0)
+        root_layer.finish([])
+        layers = [root_layer]
+
+        while stats.states_searched <= context.max_states and layers[-1].count > 0:
+            if len(layers) > context.max_solution_length:
+                break
+
+            stats.iterations += 1
+            depth = len(layers)
+            layer = ExternalLayer(directory, depth)
+            stopped = False
+
+            for fingerprint, previous_move, current_state in layers[-1]:
+                if context.stop_requested():
+                    stopped = True
+                    break
+
+                if current_state.is_won():
+                    solution = get_layer_actions(layers, depth - 1, fingerprint)
+                    break
+
+                stats.states_expanded += 1
+
+                for action in current_state.get_legal_actions(allow_cheats):
+                    move = encode_action(action)
+                    if prune and is_redundant_move(previous_move, move):
+                        stats.states_pruned += 1
+                        continue
+
+                    clone = current_state.clone()
+                    clone.apply_action(action)
+
+                    # Checked here, as the state budget may end the search before the next layer is read
+                    if clone.is_won():
+                        solution = get_layer_actions(layers, depth - 1, fingerprint) + [action]
+                        break
+
+                    if prune and is_dead_end(clone):
+                        stats.states_pruned += 1
+                        continue
+
+                    child_fingerprint = get_fingerprint(clone.canonical_key())
+                    heuristic_score = clone.get_heuristic_value()
+                    if heuristic_score >= highest_heuristic:
+                        highest_heuristic = heuristic_score
+                        best_state = (depth, child_fingerprint)
+
+                    layer.add(
+                        child_fingerprint,
+                        fingerprint,
+                        move,
+                        clone,
+                        clone.get_distance_estimate(),
+                        heuristic_score,
+                    )
+
+                if solution is not None:
+                    break
+
+            if solution is not None:
+                break
+
+            stats.duplicates_pruned += layer.finish(layers)
+            stats.states_searched += layer.count
+            stats.frontier_peak = max(stats.frontier_peak, layer.count)
+            layer.select(context.beam_width)
+            layers.append(layer)
+
+            if stopped:
+                break
+
+        if solution is not None:
+            result = SearchResult("external", True, solution, stats)
+        else:
+            result = SearchResult("external", False, get_layer_actions(layers, *best_state), stats)
+
+        for layer in layers:
+            layer.remove()
+
+    return result
+
+
+SEARCH_ENGINES = {
+    "greedy": greedy_search,
+    "astar": weighted_astar_search,
+    "ida": ida_star_search,
+    "beam": beam_search,
+    "inplace": inplace_ida_star_search,
+    "external": external_search,
+}
+
+
+def run_search(engine, state, context):
+    """
+    Runs the search engine with the given name on the given state
+    Returns a SearchResult with the elapsed time filled in
+    """
+    start_time = time.perf_counter()
+    result = SEARCH_ENGINES[engine](state, context)
+    result.stats.elapsed = time.perf_counter() - start_time
+    return result
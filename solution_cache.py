@@ -0,0 +1,182 @@
+import json
+import sqlite3
+import threading
+import time
+
+from game_state import invert_permutation, remap_action
+from search import SearchResult, SearchStats
+
+# File the solutions are cached in by solver.py
+SOLUTION_CACHE_FILE = "solutions.sqlite3"
+
+
+class SolutionCache:
+    """
+    On-disk cache of the solutions of deals in an SQLite database
+
+    Deals are keyed by the canonical key of their initial state, so a deal is found again even if its stacks
+    are dealt in a different order. The actions are stored with the stack indices of the canonical order and
+    mapped back to the order of the looked up state. Solutions found with and without cheats are kept apart, so
+    a plan with cheating actions is never returned when cheats are not allowed
+
+    Deals that were not solved keep the actions leading to the best state found so far and the statistics of
+    all attempts, so that a later attempt can resume from there
+    """
+
+    def __init__(self, path=SOLUTION_CACHE_FILE):
+        # The cache is used from the solve stage of the pipeline, not only from the thread that opened it
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(solutions)")]
+            if columns and "cheats" not in columns:
+                # Written before the solutions were keyed by the cheat setting. The plans are moved over as
+                # found with cheats allowed, which is valid for any of them
+                self.connection.execute("ALTER TABLE solutions RENAME TO old_solutions")
+
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS solutions (
+                    deal BLOB NOT NULL,
+                    cheats INTEGER NOT NULL,
+                    solved INTEGER NOT NULL,
+                    actions TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    states_searched INTEGER NOT NULL,
+                    states_expanded INTEGER NOT NULL,
+                    elapsed REAL NOT NULL,
+                    updated TEXT NOT NULL,
+                    PRIMARY KEY (deal, cheats)
+                )
+                """
+            )
+
+            if columns and "cheats" not in columns:
+                self.connection.execute(
+                    "INSERT INTO solutions SELECT deal, 1, solved, actions, engine, attempts, states_searched, "
+                    "states_expanded, elapsed, updated FROM old_solutions"
+                )
+                self.connection.execute("DROP TABLE old_solutions")
+
+    def lookup(self, state, allow_cheats=True):
+        """
+        Returns a 2-tuple (result, attempts) with the cached SearchResult of the deal searched with the given
+        cheat setting and the number of searches it took, or None if the deal is not in the cache
+        The actions of the result are in the stack order of the given state, and the statistics are the sums
+        over all attempts. If the deal was not solved, the actions lead to the best state found so far
+        """
+        key, permutation = state.canonical_form()
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT solved, actions, engine, attempts, states_searched, states_expanded, elapsed "
+                "FROM solutions WHERE deal = ? AND cheats = ?",
+                (key, int(allow_cheats)),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        solved, actions, engine, attempts, states_searched, states_expanded, elapsed = row
+
+        stats = SearchStats()
+        stats.states_searched = states_searched
+        stats.states_expanded = states_expanded
+        stats.elapsed = elapsed
+
+        actions = [remap_action(action, permutation) for action in json.loads(actions)]
+        return SearchResult(engine, bool(solved), actions, stats), attempts
+
+    def store(self, state, result, allow_cheats=True):
+        """
+        Stores the result of a search of the deal with the given initial state and cheat setting
+        A solution replaces an earlier one only if it is shorter. For a deal that is not solved, the actions
+        are kept if they reach a state with a higher heuristic score than the earlier attempts, otherwise they
+        are cleared, so the next attempt starts over from the initial state
+        """
+        key, permutation = state.canonical_form()
+        stack_map = invert_permutation(permutation)
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT solved, actions, attempts, states_searched, states_expanded, elapsed "
+                "FROM solutions WHERE deal = ? AND cheats = ?",
+                (key, int(allow_cheats)),
+            ).fetchone()
+
+            actions = [remap_action(action, stack_map) for action in result.actions]
+            engine = result.engine
+            attempts = 1
+            stats = result.stats
+            states_searched = stats.states_searched
+            states_expanded = stats.states_expanded
+            elapsed = stats.elapsed
+
+            if row is not None:
+                old_solved, old_actions, old_attempts, old_searched, old_expanded, old_elapsed = row
+                old_actions = json.loads(old_actions)
+
+                attempts += old_attempts
+                states_searched += old_searched
+                states_expanded += old_expanded
+                elapsed += old_elapsed
+
+                if old_solved and (not result.solved or len(old_actions) <= len(actions)):
+                    # Keep the earlier solution
+                    self.connection.execute(
+                        "UPDATE solutions SET attempts = ?, states_searched = ?, states_expanded = ?, "
+                        "elapsed = ?, updated = ? WHERE deal = ? AND cheats = ?",
+                        (
+                            attempts,
+                            states_searched,
+                            states_expanded,
+                            elapsed,
+                            get_timestamp(),
+                            key,
+                            int(allow_cheats),
+                        ),
+                    )
+                    return
+
+                if not result.solved and not old_solved:
+                    old_actions = [remap_action(action, permutation) for action in old_actions]
+                    if get_final_score(state, result.actions) <= get_final_score(state, old_actions):
+                        # No progress since the last attempt, start over next time
+                        actions = []
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO solutions (deal, cheats, solved, actions, engine, attempts, "
+                "states_searched, states_expanded, elapsed, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    int(allow_cheats),
+                    int(result.solved),
+                    json.dumps(actions),
+                    engine,
+                    attempts,
+                    states_searched,
+                    states_expanded,
+                    elapsed,
+                    get_timestamp(),
+                ),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_final_score(state, actions):
+    """
+    Returns the heuristic score of the state the actions lead to from the given state
+    """
+    state = state.clone()
+    for action in actions:
+        state.apply_action(action)
+    return state.get_heuristic_value()
+
+
+def get_timestamp():
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
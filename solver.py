@@ -1,13 +1,21 @@
-import PIL
-from PIL import ImageGrab
 import time
-import functools
-import math
+import argparse
+import numpy as np
 from pynput.mouse import Button, Controller
 
 from game_state import GameState, STACK_COUNT, INITIAL_STACK_SIZE, MAX_STACK_SIZE
-
-# Constants used to crop the game view from the whole screen
+from search import SearchContext, SEARCH_ENGINES, run_search
+from parallel import PARALLEL_ENGINES, parallel_search
+from portfolio import portfolio_search
+from capture import create_capture
+from pipeline import GamePipeline, improve_plan
+from optimizer import optimize_actions
+from tuning import HEURISTIC_WEIGHTS_FILE, load_heuristic_weights
+from solution_cache import SOLUTION_CACHE_FILE, SolutionCache
+from endgame import ENDGAME_FILE, EndgameDatabase
+from metrics import MetricsLog, instrument_search, phase, profile_search
+
+# Constants used to locate the game view on the screen
 # Works properly if game is in native resolution
 
 GAME_WIDTH = 1300
@@ -46,21 +54,112 @@ CARD_LOOKUP[12] = (141, 141, 141, 90, 90, 90)  # D
 CARD_LOOKUP[13] = (134, 134, 134, 128, 128, 128)  # K
 CARD_LOOKUP[14] = (106, 106, 106, 122, 122, 122)  # T
 
+CARD_LOOKUP_VALUES = np.array(list(CARD_LOOKUP.keys()))
+CARD_LOOKUP_COLORS = np.array(list(CARD_LOOKUP.values()))
+
+# The corner color is averaged from a CORNER_SIZE x CORNER_SIZE square, CORNER_OFFSET pixels from the top left
+CORNER_OFFSET = 2
+CORNER_SIZE = 11
+
+# Top left corners of the card values of each stack and each row in the game view
+CARD_SLOT_LEFTS = (
+    BOARD_TOP_LEFT[0]
+    + np.arange(STACK_COUNT) * BOARD_HORIZONTAL_DELIMITER
+    + CARD_VALUE_OFFSET[0]
+)
+CARD_SLOT_TOPS = (
+    BOARD_TOP_LEFT[1]
+    + np.arange(MAX_STACK_SIZE) * BOARD_VERTICAL_DELIMITER
+    + CARD_VALUE_OFFSET[1]
+)
+
 # Autoplay parmeters
 CLICK_STACKS = [[(0, 0) for j in range(MAX_STACK_SIZE)] for i in range(STACK_COUNT)]
 
+# Search engine used to solve the games, one of search.SEARCH_ENGINES
+# greedy: greedy best-first search, astar: weighted A*, ida: iterative deepening A*, beam: beam search
+SEARCH_ENGINE = "greedy"
+# Number of states searched before giving up and replaying the actions of the highest found heuristic score
+MAX_STATES = 50000
 MAX_SOLUTION_LENGTH = 100
+# Maximum number of states kept in the search frontier, lowest-scored states are evicted first
+# None for unbounded
+MAX_FRONTIER_SIZE = None
+# Maximum number of visited states remembered for duplicate detection, oldest are evicted first
+# States are compared by their canonical key, so boards that only differ by the order of the stacks are the same
+MAX_TRANSPOSITION_TABLE_SIZE = 1000000
+# Number of processes used to solve a single game, 1 solves in this process
+PARALLEL_WORKERS = 1
+# Seconds to solve a single game in, racing the strategies of portfolio.PORTFOLIO_STRATEGIES against each other
+# instead of running SEARCH_ENGINE. None to use SEARCH_ENGINE
+SOLVE_TIME_BUDGET = None
+# Shorten the found solution before replaying it, removing cycles and searching the rest of it again for a shorter win
+OPTIMIZE_SOLUTION = True
+# Keep the solutions in SOLUTION_CACHE_FILE, a deal that was seen before is replayed without searching
+USE_SOLUTION_CACHE = True
+# Finish the searches with the exact endgame distances of endgame.py, read from ENDGAME_FILE if it was built
+USE_ENDGAME_DATABASE = True
+# Also search the sequences of actions completing a collapse as single actions (see macros.py)
+USE_MACRO_ACTIONS = True
 
 REPLAY_WAIT_BETWEEN_ACTIONS = 0.05
 REPLAY_MOUSE_MOVE_TIME = 0.05
 REPLAY_MOUSE_BUTTON_HOLD_TIME = 0.05
 
+# Adaptive replay timing
+# Each action is verified by reading the two affected stacks from the board. The REPLAY_* delays are scaled down
+# by REPLAY_SPEED_UP_FACTOR after each verified action and scaled up by REPLAY_BACK_OFF_FACTOR when the
+# verification fails, within the given limits. The scale never goes back down to a scale that was too fast
+VERIFY_REPLAY = True
+REPLAY_MIN_DELAY_SCALE = 0.2
+REPLAY_MAX_DELAY_SCALE = 2.0
+REPLAY_SPEED_UP_FACTOR = 0.8
+REPLAY_BACK_OFF_FACTOR = 2.0
+# Seconds to wait for an action to show up on the board, and the interval between the reads
+REPLAY_VERIFY_TIMEOUT = 0.5
+REPLAY_VERIFY_INTERVAL = 0.02
+# Number of times an action that did not register is played before giving up on the game
+REPLAY_MAX_ATTEMPTS = 3
+# Empty spot of the game view left of the stacks, clicked before an action is played again to put down a card
+# that is still picked up because only the first click of the action registered
+REPLAY_NEUTRAL_POSITION = (40, GAME_HEIGHT // 2)
+
+# Board ready detection after starting a new game
+# The board is read every BOARD_POLL_INTERVAL seconds until it shows a complete deal
+# BOARD_STABLE_READS times in a row
+BOARD_POLL_INTERVAL = 0.1
+BOARD_STABLE_READS = 2
+# Seconds to wait after clicking new game before the first read, so the previous board is not read
+NEW_GAME_MIN_DELAY = 0.5
+# Seconds to wait for the board before clicking new game again
+BOARD_READY_TIMEOUT = 10
+# Seconds to wait after replaying a solution for the game to accept the new game click
+POST_GAME_DELAY = 1
+
 # Run parameters
 RUN_COUNT = 100
 ALLOW_CHEATS = True
 
 
 def main():
+    arguments = parse_arguments()
+
+    # Use the heuristic weights written by tuning.py, if there are any
+    if load_heuristic_weights(HEURISTIC_WEIGHTS_FILE) is not None:
+        print("Loaded heuristic weights from", HEURISTIC_WEIGHTS_FILE)
+    engine_options = {}
+    if arguments.weight is not None:
+        engine_options["weight"] = arguments.weight
+    if arguments.beam_width is not None:
+        engine_options["beam_width"] = arguments.beam_width
+    if USE_ENDGAME_DATABASE:
+        engine_options["endgame"] = EndgameDatabase(ENDGAME_FILE)
+    if USE_MACRO_ACTIONS:
+        engine_options["macros"] = True
+
+    capture = create_capture(arguments.capture_image)
+    locate_game(capture)
+
     intro_print()
     time.sleep(1)
 
@@ -69,19 +168,99 @@ def main():
     click_on(mouse, CLICK_STACKS[0][0])
     time.sleep(0.5)
 
+    if VERIFY_REPLAY and not arguments.capture_image:
+        timing = ReplayTiming()
+
+        def replay(state, action):
+            return replay_verified_action(mouse, capture, timing, state, action)
+
+    else:
+        # A screenshot never changes, so the actions can't be verified on it
+        def replay(state, action):
+            replay_action(mouse, action)
+            return True
+
+    cache = SolutionCache(SOLUTION_CACHE_FILE) if USE_SOLUTION_CACHE else None
+
+    # Metrics are only collected when they are logged or the searches are profiled
+    metrics_log = None
+    if arguments.metrics or arguments.profile:
+        metrics_log = MetricsLog(arguments.metrics, arguments.profile)
+
     # Loop the solving + new game
-    for i in range(RUN_COUNT):
-        # Click on new game once
-        print("\nNEW GAME\n", flush=True)
-        click_on(mouse, NEW_GAME_BUTTON, False)
-        print(
-            "If you need to exit, now is the time. Ctrl+C or close the console window.",
-            flush=True,
-        )
-        time.sleep(5)
-        print("Solving, please wait...", flush=True)
-        solve()
-        time.sleep(1)
+    # The rest of the plan is verified and shortened while it is being replayed. The next game is only started,
+    # read and searched once the replay is over and POST_GAME_DELAY has passed, as it needs the board
+    pipeline = GamePipeline(
+        start_game=lambda metrics: start_game(mouse, capture, metrics),
+        solve_game=lambda state, metrics: search_game(
+            state,
+            arguments.engine,
+            arguments.workers,
+            cache,
+            metrics,
+            arguments.time_budget,
+            **engine_options,
+        ),
+        improve_plan=lambda state, plan: improve_plan(state, plan, ALLOW_CHEATS),
+        replay_action=replay,
+        game_count=RUN_COUNT,
+        post_game_delay=POST_GAME_DELAY,
+        metrics_log=metrics_log,
+    )
+    pipeline.run()
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Solver/bot for solitaire in MOLEK-SYNTEZ")
+    parser.add_argument(
+        "--engine",
+        choices=sorted(SEARCH_ENGINES),
+        default=SEARCH_ENGINE,
+        help="search engine used to solve the games (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--capture-image",
+        help="read the board from this screenshot (of the whole screen or the game view) instead of the screen",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PARALLEL_WORKERS,
+        help="number of processes used to solve a single game (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=SOLVE_TIME_BUDGET,
+        help="seconds to solve a game in, racing several search strategies instead of using --engine",
+    )
+    parser.add_argument(
+        "--weight",
+        type=float,
+        help="weight of the distance estimate for the astar, ida and inplace engines",
+    )
+    parser.add_argument(
+        "--beam-width",
+        type=int,
+        help="number of states kept per layer for the beam and external engines",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="log the counters and phase timings of each game into this file (CSV if it ends with .csv, "
+        "JSON lines otherwise)",
+    )
+    parser.add_argument(
+        "--profile",
+        help="profile the search of each game with cProfile into a file in this directory",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.workers > 1 and arguments.time_budget is None and arguments.engine not in PARALLEL_ENGINES:
+        parser.error("--workers only works with the {} engines".format(", ".join(PARALLEL_ENGINES)))
+    return arguments
 
 
 def intro_print():
@@ -94,126 +273,180 @@ def intro_print():
     print(flush=True)
 
 
-def solve():
+def wait_for_board(capture, metrics=None):
     """
-    Solves the current game configuration
+    Waits for the new game shuffle to finish by reading the board until it shows the same complete deal
+    BOARD_STABLE_READS times in a row
+    Returns the state of the board, or None if no complete deal was read within BOARD_READY_TIMEOUT seconds
     """
-    image = ImageGrab.grab()
-    image = crop(image)
+    time.sleep(NEW_GAME_MIN_DELAY)
+    deadline = time.perf_counter() + BOARD_READY_TIMEOUT
 
-    # image = PIL.Image.open("reference.bmp")
+    previous_key = None
+    stable_reads = 0
 
-    # Initialize the beginning game state
-    state = GameState()
+    while True:
+        state = read_board(capture, metrics)
 
-    # Parse the image and populate the state
-    populate_state(image, state)
+        if state.is_valid_deal():
+            key = state.key()
+            stable_reads = stable_reads + 1 if key == previous_key else 1
+            previous_key = key
+            if stable_reads >= BOARD_STABLE_READS:
+                return state
+        else:
+            previous_key = None
+            stable_reads = 0
 
-    # Setup lookups and other structures for the main solving loop
-    state_history = {}
-    search_stack = []
+        if time.perf_counter() > deadline:
+            print("Board was not recognized, starting a new game. Last read:")
+            print(state, flush=True)
+            return None
 
-    # Initialize the search stack
-    search_stack.append((state, [], 0))
-    shortest_solution = [0 for i in range(10000)]
+        time.sleep(BOARD_POLL_INTERVAL)
 
-    original_state = state.clone()
-    highest_heuristic = -999
 
-    # DEBUG
-    print_highest_heuristic = 0
-    print_interval = 1000
-    print_since = 0
-    print_state_interval = 10000
-    print_state_since = 0
+def read_board(capture, metrics=None):
+    """
+    Captures the card slots of the initial deal and parses them into a new GameState
+    """
+    # Only capture the card slots of the initial deal
+    area = get_card_area(INITIAL_STACK_SIZE)
+    with phase(metrics, "capture"):
+        image = capture_game(capture, area)
 
-    # Start the main solving loop
-    states_searched = 0
+    # Initialize the beginning game state
+    state = GameState()
 
-    while True:
-        if states_searched > 50000:
-            print("50k searched, applying actions of highest found heuristic score")
-            break
-        if len(search_stack) == 0 and len(state_history) > 0:
-            print("Unable to find solution")
-            break
-
-        # Take state from the end of stack
-        current_search_item = search_stack.pop()
-        current_state = current_search_item[0]
-        current_history = current_search_item[1]
-
-        # DEBUG
-        if (
-            current_search_item[2] > print_highest_heuristic
-            or print_since > print_interval
-        ):
-            print(
-                "Top heuristic",
-                highest_heuristic,
-                "Heuristic",
-                current_search_item[2],
-                "Stack size",
-                len(search_stack),
-                "Searched",
-                states_searched,
-                flush=True,
-            )
+    # Parse the image and populate the state
+    with phase(metrics, "parse"):
+        populate_state(image, state, area[:2])
 
-        if print_state_since > print_state_interval:
-            print("Current state", current_state)
-
-        if current_search_item[2] > print_highest_heuristic:
-            print_highest_heuristic = current_search_item[2]
-        if print_since > print_interval:
-            print_since = 0
-        if print_state_since > print_state_interval:
-            print_state_since = 0
-        print_since += 1
-        print_state_since += 1
-
-        # End searches that run too deep
-        if len(current_history) > MAX_SOLUTION_LENGTH:
-            continue
-
-        if current_state.is_won():
-            print("New solution")
-            print("Length:", len(current_history))
-            print("States searched:", states_searched)
-            print("Stack size:", len(search_stack))
-            print(flush=True)
-            break
+    return state
 
-        current_actions = current_state.get_legal_actions(ALLOW_CHEATS)
 
-        for action in current_actions:
-            clone = current_state.clone()
-            clone.apply_action(action)
+def start_game(mouse, capture, metrics=None):
+    """
+    Clicks on new game and waits for the board to be dealt
+    Returns the GameState read from the board, or None if the board could not be read
+    """
+    # Click on new game once
+    print("\nNEW GAME\n", flush=True)
+    click_on(mouse, NEW_GAME_BUTTON, False)
+    print(
+        "If you need to exit, now is the time. Ctrl+C or close the console window.",
+        flush=True,
+    )
+    state = wait_for_board(capture, metrics)
+    if state is not None:
+        print("Solving, please wait...", flush=True)
+    return state
 
-            # Hash the state, make sure we don't revisit a state
-            clone_hash = hash(clone)
-            if clone_hash in state_history:
-                if state_history[clone_hash] == clone:
-                    continue
-            state_history[clone_hash] = clone
 
-            heuristic_score = clone.get_heuristic_value()
+def solve(state, engine=SEARCH_ENGINE, workers=PARALLEL_WORKERS, **engine_options):
+    """
+    Solves the given game state with the given search engine and replays the solution
+    """
+    result = search_game(state, engine, workers, **engine_options)
 
-            if heuristic_score >= highest_heuristic:
-                highest_heuristic = heuristic_score
-                shortest_solution = current_history + [action]
+    # print("Skipping replay...")
+    replay_actions(result.actions)
+
+
+def search_game(
+    state,
+    engine=SEARCH_ENGINE,
+    workers=PARALLEL_WORKERS,
+    cache=None,
+    metrics=None,
+    time_budget=None,
+    **engine_options,
+):
+    """
+    Solves the given game state with the given search engine and prints the search statistics
+    With more than one worker the search is split between that many processes
+    With a SolutionCache, a cached solution is returned without searching, and a deal that was not solved
+    before is resumed from the best state of the earlier attempts with a larger state budget
+    With a GameMetrics, the search statistics and the time spent in each phase of the search are recorded
+    With a time budget, the strategies of portfolio_search are raced for that many seconds instead of running
+    the engine, and the first one to solve the game wins
+    Extra keyword arguments are passed on to the SearchContext (weight, beam_width, endgame, macros)
+    Returns the SearchResult
+    """
 
-            new_history = list(current_history)
-            new_history += [action]
+    context_options = dict(
+        allow_cheats=ALLOW_CHEATS,
+        max_states=MAX_STATES,
+        max_solution_length=MAX_SOLUTION_LENGTH,
+        max_frontier_size=MAX_FRONTIER_SIZE,
+        max_table_size=MAX_TRANSPOSITION_TABLE_SIZE,
+        **engine_options,
+    )
 
-            search_stack.append((clone, new_history, heuristic_score))
-            states_searched += 1
+    # Actions of the earlier attempts the search continues from
+    cached_actions = []
+    start_state = state
+
+    allow_cheats = context_options["allow_cheats"]
+    cached = cache.lookup(state, allow_cheats) if cache is not None else None
+    if cached is not None:
+        cached_result, attempts = cached
+        if cached_result.solved:
+            print("Found in the solution cache, solved by", cached_result.engine)
+            print("Length:", len(cached_result.actions))
+            print(flush=True)
+            if metrics is not None:
+                metrics.add_search_result(cached_result)
+            return cached_result
+
+        cached_actions = cached_result.actions
+        start_state = state.clone()
+        for action in cached_actions:
+            start_state.apply_action(action)
+        context_options["max_states"] *= attempts + 1
+        context_options["max_solution_length"] -= len(cached_actions)
+        print("Attempt", attempts + 1, "resuming after", len(cached_actions), "cached actions")
+
+    with phase(metrics, "search"), profile_search(metrics):
+        if time_budget is not None:
+            result = portfolio_search(start_state, time_budget, **context_options)
+        elif workers > 1:
+            result = parallel_search(
+                engine, start_state, workers, MAX_TRANSPOSITION_TABLE_SIZE, **context_options
+            )
+        elif metrics is not None:
+            with instrument_search(metrics):
+                result = run_search(engine, start_state, SearchContext(**context_options))
+        else:
+            result = run_search(engine, start_state, SearchContext(**context_options))
+    result.actions = cached_actions + result.actions
+
+    print("Solved" if result.solved else "No solution found", "by", result.engine)
+    print("Length:", len(result.actions))
+    print("States searched:", result.stats.states_searched)
+    print("States expanded:", result.stats.states_expanded)
+    print("States pruned:", result.stats.states_pruned)
+    print("Frontier peak:", result.stats.frontier_peak)
+    print("Time: {:.2f}s".format(result.stats.elapsed))
+
+    if OPTIMIZE_SOLUTION and result.solved:
+        start = time.perf_counter()
+        length = len(result.actions)
+        with phase(metrics, "optimize"):
+            result.actions = optimize_actions(state, result.actions, ALLOW_CHEATS)
+        print(
+            "Optimized length: {} -> {} ({:.2f}s)".format(
+                length, len(result.actions), time.perf_counter() - start
+            )
+        )
+    print(flush=True)
 
-        # Sort the search stack such that the latest action has the highest heuristic score
-        search_stack.sort(key=lambda item: item[2])
+    if cache is not None:
+        cache.store(state, result, allow_cheats)
+    if metrics is not None:
+        metrics.add_search_result(result)
 
-    # print("Skipping replay...")
-    replay_actions(shortest_solution)
+    return result
 
 
 def replay_actions(actions):
@@ -226,47 +459,178 @@ def replay_actions(actions):
     time.sleep(0.5)
 
     for action in actions:
-        # print(action, flush=True)
+        replay_action(mouse, action)
 
-        # Stack to stack
-        from_position = CLICK_STACKS[action[0][0]][action[0][1]]
-        # Always drag onto the 6th card, which will cover all vertical positions
-        # Drag the card onto the top card of the stack. The to_action's 4th parameter is the current stack height
-        to_position = CLICK_STACKS[action[1][2]][action[1][3]]
-        # Shenzhen works by dragging
-        # drag_from_to(mouse, from_position, to_position)
 
-        # In MOLEK-SYNTEZ you have to click both start and end location
-        click_on(mouse, from_position)
-        click_on(mouse, to_position)
+def replay_action(mouse, action, delay_scale=1.0):
+    """
+    Plays a single action on the board
+    The REPLAY_* delays are multiplied by delay_scale
+    """
+    # print(action, flush=True)
+
+    # Stack to stack
+    from_position = CLICK_STACKS[action[0][0]][action[0][1]]
+    # Always drag onto the 6th card, which will cover all vertical positions
+    # Drag the card onto the top card of the stack. The to_action's 4th parameter is the current stack height
+    to_position = CLICK_STACKS[action[1][2]][action[1][3]]
+    # Shenzhen works by dragging
+    # drag_from_to(mouse, from_position, to_position, delay_scale)
+
+    # In MOLEK-SYNTEZ you have to click both start and end location
+    click_on(mouse, from_position, delay_scale=delay_scale)
+    click_on(mouse, to_position, delay_scale=delay_scale)
 
 
-def click_on(mouse, position, game_space=True):
+class ReplayTiming:
+    """
+    Scale of the REPLAY_* delays, shrunk while the actions are verified on the board and grown when they are not
+    A scale that was too fast is not used again, the lowest scale is kept one step above it
+    """
+
+    def __init__(self):
+        self.scale = 1.0
+        self.min_scale = REPLAY_MIN_DELAY_SCALE
+
+    def speed_up(self):
+        self.scale = max(self.min_scale, self.scale * REPLAY_SPEED_UP_FACTOR)
+
+    def back_off(self):
+        self.scale = min(REPLAY_MAX_DELAY_SCALE, self.scale * REPLAY_BACK_OFF_FACTOR)
+
+    def avoid(self, scale):
+        """
+        Keeps the scale above the given scale, which was too fast
+        """
+        self.min_scale = min(REPLAY_MAX_DELAY_SCALE, max(self.min_scale, scale / REPLAY_SPEED_UP_FACTOR))
+
+
+def replay_verified_action(mouse, capture, timing, state, action):
+    """
+    Plays a single action on the board showing the given state, and verifies that the two affected stacks show
+    the cards of the state after the action. Speeds up the replay timing when the action is verified and backs
+    it off when not. An action that did not register at all is played again, after a click on an empty spot
+    that puts down the picked up card if only its first click registered
+    Returns False if the board is out of sync with the expected state
+    """
+    expected_state = state.clone()
+    expected_state.apply_action(action)
+    stack_indices = sorted({action[0][0], action[1][2]})
+
+    failed_scale = None
+
+    for _ in range(REPLAY_MAX_ATTEMPTS):
+        replay_action(mouse, action, timing.scale)
+
+        if wait_for_stacks(capture, expected_state, stack_indices):
+            if failed_scale is not None:
+                # The action registered when played slower, so the scale it failed with is too fast
+                timing.avoid(failed_scale)
+            timing.speed_up()
+            return True
+
+        if failed_scale is None:
+            failed_scale = timing.scale
+        timing.back_off()
+
+        # Only play the action again if the board still shows the stacks from before it once nothing is
+        # picked up
+        click_on(mouse, REPLAY_NEUTRAL_POSITION, delay_scale=timing.scale)
+        if not wait_for_stacks(capture, state, stack_indices):
+            return False
+        print("Action did not register, retrying with delay scale {:.2f}".format(timing.scale))
+
+    return False
+
+
+def wait_for_stacks(capture, state, stack_indices):
+    """
+    Reads the given stacks from the board until they show the cards of the state
+    Returns False if they don't within REPLAY_VERIFY_TIMEOUT seconds
+    """
+    deadline = time.perf_counter() + REPLAY_VERIFY_TIMEOUT
+
+    while not stacks_match(capture, state, stack_indices):
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(REPLAY_VERIFY_INTERVAL)
+
+    return True
+
+
+def stacks_match(capture, state, stack_indices):
+    """
+    Returns True if the given stacks on the board show the cards of the state, and no card above them
+    Finished stacks are not checked, and only the cards below a cheated card are checked
+    """
+    stacks = state.stacks
+    cheats = state.cheats
+    stack_indices = [i for i in stack_indices if stacks[i] is not None]
+    if len(stack_indices) == 0:
+        return True
+
+    rows = min(MAX_STACK_SIZE, max(len(stacks[i]) for i in stack_indices) + 1)
+    card_values = read_stacks(capture, stack_indices, rows)
+
+    for i, values in zip(stack_indices, card_values):
+        expected = stacks[i]
+        if cheats[i]:
+            # A cheated card is not checked, nor the slot above it
+            expected = expected[:-1]
+        elif len(expected) < rows:
+            # The slot above the top card must be empty
+            expected = expected + [0]
+
+        if values[: len(expected)].tolist() != expected:
+            return False
+
+    return True
+
+
+def read_stacks(capture, stack_indices, rows):
+    """
+    Captures the card slots of the first given number of rows of the given stacks
+    Returns an array of shape (len(stack_indices), rows) of card values, 0 where no card was recognized
+    """
+    lefts = CARD_SLOT_LEFTS[stack_indices]
+    area = (
+        int(lefts.min()),
+        int(CARD_SLOT_TOPS[0]),
+        int(lefts.max()) + CARD_VALUE_SIZE[0],
+        int(CARD_SLOT_TOPS[rows - 1]) + CARD_VALUE_SIZE[1],
+    )
+    pixels = np.asarray(capture_game(capture, area).convert("RGB"))
+
+    sampled_colors = sample_card_colors(pixels, rows, area[:2], stack_indices)
+    return match_card_colors(sampled_colors)
+
+
+def click_on(mouse, position, game_space=True, delay_scale=1.0):
     screen_position = game_to_screen(position) if game_space else position
     mouse.position = screen_position
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
     mouse.press(Button.left)
-    time.sleep(REPLAY_MOUSE_BUTTON_HOLD_TIME)
+    time.sleep(REPLAY_MOUSE_BUTTON_HOLD_TIME * delay_scale)
     mouse.release(Button.left)
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
 
 
-def drag_from_to(mouse, from_position, to_position):
+def drag_from_to(mouse, from_position, to_position, delay_scale=1.0):
     screen_from_position = game_to_screen(from_position)
     screen_to_position = game_to_screen(to_position)
     mouse.position = screen_from_position
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
     mouse.press(Button.left)
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
     mouse.position = screen_to_position
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
     mouse.release(Button.left)
-    time.sleep(REPLAY_MOUSE_MOVE_TIME)
+    time.sleep(REPLAY_MOUSE_MOVE_TIME * delay_scale)
 
 
-def crop(image):
+def locate_game(capture):
     """
-    Crop the image to only contain the game view
+    Locate the game view on the screen
     Define the game view as a defined rectangle around the center of the screen
     Assume the game is in native resolution
     Confirmed to work in 1080p and 1440p
@@ -274,121 +638,110 @@ def crop(image):
     global GAME_LEFT
     global GAME_TOP
 
-    width = image.size[0]
-    height = image.size[1]
-    game_width = GAME_WIDTH
-    game_height = GAME_HEIGHT
+    width, height = capture.get_screen_size()
 
-    GAME_LEFT = (width - game_width) / 2.0
-    GAME_TOP = (height - game_height) / 2.0
+    GAME_LEFT = (width - GAME_WIDTH) // 2
+    GAME_TOP = (height - GAME_HEIGHT) // 2
 
-    return image.crop((GAME_LEFT, GAME_TOP, width - GAME_LEFT, height - GAME_TOP))
 
+def capture_game(capture, area=None):
+    """
+    Captures the given rectangle (left, top, right, bottom) of the game view, or the whole game view
+    Only the requested rectangle is grabbed from the screen
+    """
+    if area is None:
+        area = (0, 0, GAME_WIDTH, GAME_HEIGHT)
+
+    return capture.grab(
+        (GAME_LEFT + area[0], GAME_TOP + area[1], GAME_LEFT + area[2], GAME_TOP + area[3])
+    )
 
-def populate_state(image, state):
+
+def populate_state(image, state, origin=(0, 0)):
     """
     Parse the image and populate the given game state
+    origin is the position of the top left corner of the image in the game view, the image must contain
+    the card slots of the initial deal
     """
 
-    sampled_colors = {}
-
-    # Loop through the board and extract color data from card values
+    # Store the click positions of all card slots for replaying
     for i in range(STACK_COUNT):
         for j in range(MAX_STACK_SIZE):
-            left = (
-                BOARD_TOP_LEFT[0]
-                + i * BOARD_HORIZONTAL_DELIMITER
-                + CARD_VALUE_OFFSET[0]
-            )
-            top = (
-                BOARD_TOP_LEFT[1] + j * BOARD_VERTICAL_DELIMITER + CARD_VALUE_OFFSET[1]
-            )
-
-            CLICK_STACKS[i][j] = (left, top)
-
-            if j >= INITIAL_STACK_SIZE:
-                continue
-
-            right = left + CARD_VALUE_SIZE[0]
-            bottom = top + CARD_VALUE_SIZE[1]
-            card_value = image.crop((left, top, right, bottom))
+            CLICK_STACKS[i][j] = (int(CARD_SLOT_LEFTS[i]), int(CARD_SLOT_TOPS[j]))
 
-            # Get avg from top left corner
-            top_left_avg = sample_avg_color(card_value, (5, 5))
-
-            # Get overall color average
-            pixels = list(card_value.getdata())
-            avg_color = avg_color_list(pixels)
+    # Convert only the part of the image with the card slots once, all of them are sampled from the same array
+    area = get_card_area(INITIAL_STACK_SIZE)
+    image = image.crop(
+        (area[0] - origin[0], area[1] - origin[1], area[2] - origin[0], area[3] - origin[1])
+    )
+    pixels = np.asarray(image.convert("RGB"))
+    sampled_colors = sample_card_colors(pixels, INITIAL_STACK_SIZE, area[:2])
+    card_values = match_card_colors(sampled_colors)
 
-            comb_color = avg_color + top_left_avg
+    # Cards are parsed stack by stack, from the bottom up
+    for i in range(STACK_COUNT):
+        for j in range(INITIAL_STACK_SIZE):
+            if card_values[i, j] > 0:
+                state.parse_card_into_stack(i, int(card_values[i, j]))
 
-            sampled_colors[(i, j)] = comb_color
 
-    position_lookup = {}
+def get_card_area(rows):
+    """
+    Returns the rectangle (left, top, right, bottom) of the game view containing the card values of the first
+    given number of rows of every stack
+    """
+    return (
+        int(CARD_SLOT_LEFTS[0]),
+        int(CARD_SLOT_TOPS[0]),
+        int(CARD_SLOT_LEFTS[-1]) + CARD_VALUE_SIZE[0],
+        int(CARD_SLOT_TOPS[rows - 1]) + CARD_VALUE_SIZE[1],
+    )
 
-    # Find the card colors and values
-    for position in sampled_colors:
-        comb_color = sampled_colors[position]
 
-        # Go through all color settings and try to find the correct one, that is as close to the given values as possible
-        for card_value in CARD_LOOKUP:
-            comparison_color = CARD_LOOKUP[card_value]
+def sample_card_colors(pixels, rows, origin=(0, 0), stack_indices=None):
+    """
+    Samples the card value colors of the first given number of rows of every stack from the image array,
+    or only of the stacks in stack_indices
+    origin is the position of the top left pixel of the array in the game view
+    Returns an array of shape (stack count, rows, 6) with the average color of the whole card value
+    (CARD_VALUE_SIZE size) followed by the average color of its top left 11x11 pixels, like in CARD_LOOKUP
+    """
+    tops = CARD_SLOT_TOPS[:rows] - origin[1]
+    lefts = CARD_SLOT_LEFTS if stack_indices is None else CARD_SLOT_LEFTS[stack_indices]
+    lefts = lefts - origin[0]
 
-            # Split the 6-tuples into 3-tuples
-            sampled_avg_color = comb_color[:3]
-            sampled_check_color = comb_color[3:]
+    # Index arrays selecting the pixels of every card slot at once
+    rows_index = (tops[:, None] + np.arange(CARD_VALUE_SIZE[1]))[None, :, :, None]
+    columns_index = (lefts[:, None] + np.arange(CARD_VALUE_SIZE[0]))[:, None, None, :]
+    # Shape (STACK_COUNT, rows, height, width, 3)
+    card_pixels = pixels[rows_index, columns_index].astype(np.int32)
 
-            comparison_avg_color = comparison_color[:3]
-            comparison_check_color = comparison_color[3:]
+    average_color = card_pixels.sum(axis=(2, 3)) // (CARD_VALUE_SIZE[0] * CARD_VALUE_SIZE[1])
 
-            # Test if the colors are close to each other. Store the card position
-            if (
-                color_distance(sampled_avg_color, comparison_avg_color)
-                < COLOR_MATCH_THRESHOLD
-                and color_distance(sampled_check_color, comparison_check_color)
-                < COLOR_MATCH_THRESHOLD
-            ):
-                position_lookup[position] = card_value
-                break
+    corner = slice(CORNER_OFFSET, CORNER_OFFSET + CORNER_SIZE)
+    corner_pixels = card_pixels[:, :, corner, corner]
+    corner_color = corner_pixels.sum(axis=(2, 3)) // (CORNER_SIZE * CORNER_SIZE)
 
-    for position in sorted(position_lookup.keys()):
-        stack_index = position[0]
-        state.parse_card_into_stack(stack_index, position_lookup[position])
+    return np.concatenate((average_color, corner_color), axis=2)
 
 
-def sample_avg_color(image, position):
+def match_card_colors(sampled_colors):
     """
-    Sample an average color from the image at the given position
-    Averages a 11x11 kernel around the pixel
+    Finds the card values of the sampled colors
+    Both the average color and the corner color must be closer than COLOR_MATCH_THRESHOLD to the colors of a card
+    in CARD_LOOKUP. Returns an array of card values, 0 where no card matched
     """
-    kernel = []
-    topleft = (position[0] - 3, position[1] - 3)
-    for i in range(11):
-        for j in range(11):
-            kernel.append(image.getpixel((topleft[0] + j, topleft[1] + i)))
-    return avg_color_list(kernel)
+    # Shape (..., card count, 6)
+    difference = sampled_colors[..., None, :] - CARD_LOOKUP_COLORS
+    squared = difference * difference
 
-
-def avg_color_list(color_list):
-    """
-    Returns the average color of the given list of 3-tuples
-    """
-    colors = tuple(
-        functools.reduce(lambda x, y: tuple(map(lambda a, b: a + b, x, y)), color_list)
+    threshold = COLOR_MATCH_THRESHOLD * COLOR_MATCH_THRESHOLD
+    matches = (squared[..., :3].sum(axis=-1) < threshold) & (
+        squared[..., 3:].sum(axis=-1) < threshold
     )
-    colors = tuple(map(lambda x: x // len(color_list), colors))
-    return colors
-
 
-def color_distance(from_color, to_color):
-    """
-    Calculate the euclidean distance of two colors in 3D space
-    """
-    return math.sqrt(
-        (from_color[0] - to_color[0]) ** 2
-        + (from_color[1] - to_color[1]) ** 2
-        + (from_color[2] - to_color[2]) ** 2
-    )
+    # Use the first matching card in CARD_LOOKUP
+    return np.where(matches.any(axis=-1), CARD_LOOKUP_VALUES[matches.argmax(axis=-1)], 0)
 
 
 def game_to_screen(position):
@@ -0,0 +1,11 @@
+from game_state import GameState
+from optimizer import optimize_actions, remove_cycles
+
+
+def test_detour_without_cycle_is_shortened():
+    # Moving the 6 to the empty stack before collapsing it is a detour that never returns to an earlier state
+    state = GameState.from_stacks([None, None, None, [14, 13, 12, 11, 10, 9, 8, 7], [6], []])
+    actions = [((4, 0), (False, False, 5, 0)), ((5, 0), (False, True, 3, 8))]
+
+    assert remove_cycles(state, actions)[0] == actions
+    assert optimize_actions(state, actions, allow_cheats=False) == [((4, 0), (False, True, 3, 8))]
@@ -0,0 +1,30 @@
+import pytest
+
+from deals import generate_deals
+from game_state import GameState
+from search import SearchContext, run_search
+
+ENGINES = ["greedy", "astar", "ida", "beam", "inplace", "external"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_win_found_when_budget_runs_out(engine):
+    # The only collapse left wins the game, and the budget ends the search as soon as it is generated
+    state = GameState.from_stacks([None, None, None, [14, 13, 12, 11, 10, 9, 8, 7], [6], []])
+    result = run_search(engine, state, SearchContext(allow_cheats=False, max_states=0))
+
+    assert result.solved
+    assert result.actions == [((4, 0), (False, True, 3, 8))]
+
+
+def test_ida_win_found_at_state_budget():
+    # The winning state is generated by the last expansion within the budget
+    stacks = list(generate_deals(18, 11))[17]
+    result = run_search("ida", GameState.from_stacks(stacks), SearchContext(allow_cheats=False, max_states=50000))
+
+    assert result.solved
+
+    state = GameState.from_stacks(stacks)
+    for action in result.actions:
+        state.apply_action(action)
+    assert state.is_won()
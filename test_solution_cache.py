@@ -0,0 +1,18 @@
+from deals import generate_deals
+from game_state import GameState
+from search import SearchResult, SearchStats
+from solution_cache import SolutionCache
+
+
+def test_cheating_plan_not_returned_without_cheats(tmp_path):
+    state = GameState.from_stacks(next(generate_deals(1, 1)))
+    cheat_action = next(action for action in state.get_legal_actions(True) if action[1][0])
+
+    cache = SolutionCache(str(tmp_path / "solutions.sqlite3"))
+    cache.store(state, SearchResult("greedy", True, [cheat_action], SearchStats()), allow_cheats=True)
+
+    assert cache.lookup(state, allow_cheats=False) is None
+    result, attempts = cache.lookup(state, allow_cheats=True)
+    assert result.solved
+    assert result.actions == [cheat_action]
+    cache.close()
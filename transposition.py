@@ -0,0 +1,132 @@
+import hashlib
+import itertools
+import multiprocessing
+
+# Number of low bits of a shared table entry used for the depth
+SHARED_DEPTH_BITS = 8
+SHARED_DEPTH_MASK = (1 << SHARED_DEPTH_BITS) - 1
+# Number of consecutive slots checked for a key before giving up
+SHARED_PROBE_LIMIT = 8
+
+
+class TranspositionTable:
+    """
+    Remembers the states visited by the search, keyed by GameState.canonical_key()
+    For each state the lowest depth (number of actions) it has been reached at is stored, so that
+    a state reached again with fewer actions can be expanded again
+    """
+
+    def __init__(self, max_size=None):
+        self.depths = {}
+
+        # If set, the oldest entries are evicted when the table grows past this size
+        self.max_size = max_size
+        self.evicted = 0
+
+    def visit(self, key, depth):
+        """
+        Records the state with the given key as reached at the given depth
+        Returns True if the state should be expanded, i.e. it has not been seen before or it was
+        previously reached only with more actions
+        """
+        known_depth = self.depths.get(key)
+        if known_depth is not None and known_depth <= depth:
+            return False
+
+        self.depths[key] = depth
+
+        if self.max_size is not None and len(self.depths) > self.max_size:
+            self.evict()
+
+        return True
+
+    def evict(self):
+        """
+        Evicts the oldest entries in a batch of 10% of the maximum size
+        Evicted states may be expanded again if the search reaches them later
+        """
+        count = len(self.depths) - self.max_size + max(1, self.max_size // 10)
+        for key in list(itertools.islice(self.depths, count)):
+            del self.depths[key]
+
+        self.evicted += count
+
+    def get_depth(self, key):
+        """
+        Returns the lowest depth the state with the given key has been reached at, or None if unknown
+        """
+        return self.depths.get(key)
+
+    def __contains__(self, key):
+        return key in self.depths
+
+    def __len__(self):
+        return len(self.depths)
+
+
+class SharedTranspositionTable:
+    """
+    Transposition table in shared memory that can be used by several processes at once
+    The keys are stored as 64-bit fingerprints in a fixed-size open addressing hash table, with the depth in the
+    lowest bits of each entry. Entries are updated without locking, a lost update only means that a state may be
+    searched twice
+    """
+
+    def __init__(self, size, slots=None):
+        self.size = size
+        # Pass the slots of an existing table to use the same table in another process
+        self.slots = slots if slots is not None else multiprocessing.RawArray("Q", size)
+
+    def find_slot(self, fingerprint):
+        """
+        Returns the index of the slot holding the given fingerprint or the first free slot for it,
+        None if all probed slots are taken by other keys
+        """
+        index = (fingerprint >> SHARED_DEPTH_BITS) % self.size
+        for _ in range(SHARED_PROBE_LIMIT):
+            entry = self.slots[index]
+            if entry == 0 or entry & ~SHARED_DEPTH_MASK == fingerprint:
+                return index
+            index = (index + 1) % self.size
+
+        return None
+
+    def visit(self, key, depth):
+        """
+        Records the state with the given key as reached at the given depth
+        Returns True if the state should be expanded, see TranspositionTable.visit
+        """
+        fingerprint = get_fingerprint(key)
+        index = self.find_slot(fingerprint)
+
+        # The table is full around this key, search the state without remembering it
+        if index is None:
+            return True
+
+        entry = self.slots[index]
+        if entry != 0 and entry & SHARED_DEPTH_MASK <= depth:
+            return False
+
+        self.slots[index] = fingerprint | min(depth, SHARED_DEPTH_MASK)
+        return True
+
+    def get_depth(self, key):
+        """
+        Returns the lowest depth the state with the given key has been reached at, or None if unknown
+        """
+        index = self.find_slot(get_fingerprint(key))
+        if index is None or self.slots[index] == 0:
+            return None
+
+        return self.slots[index] & SHARED_DEPTH_MASK
+
+
+def get_fingerprint(key):
+    """
+    Returns a 64-bit fingerprint of the given bytes key with the depth bits cleared
+    The fingerprint is the same in every process, unlike the builtin hash()
+    """
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    fingerprint = int.from_bytes(digest, "little") & ~SHARED_DEPTH_MASK
+    # Zero marks a free slot
+    return fingerprint or (1 << SHARED_DEPTH_BITS)
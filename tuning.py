@@ -0,0 +1,215 @@
+import argparse
+import concurrent.futures
+import json
+import os
+
+from deals import generate_deals
+from game_state import GameState, get_heuristic_weights, set_heuristic_weights
+from search import SearchContext, SEARCH_ENGINES, MAX_STATES, run_search
+
+# File the tuned weights are written to, and loaded from by solver.py
+HEURISTIC_WEIGHTS_FILE = "heuristic_weights.json"
+
+# Corpus the weights are tuned on, and the held out corpus the tuned weights are checked on
+TUNING_SEED = 100
+TUNING_DEALS = 40
+VALIDATION_SEED = 200
+VALIDATION_DEALS = 40
+
+# Pattern search parameters
+# Each weight is moved by its step in both directions, and the steps are halved after a round
+# without improvement. Steps start at half of the weight, or at 1 for weights of 0
+TUNING_ROUNDS = 6
+MIN_STEP = 0.25
+
+
+def main():
+    arguments = parse_arguments()
+
+    context_options = dict(
+        allow_cheats=not arguments.no_cheats,
+        max_states=arguments.max_states,
+    )
+
+    tuning_deals = list(generate_deals(arguments.deals, arguments.seed))
+    validation_deals = list(generate_deals(arguments.validation_deals, arguments.validation_seed))
+
+    with concurrent.futures.ProcessPoolExecutor(arguments.workers) as executor:
+
+        def evaluate(weights, deals):
+            return evaluate_weights(weights, deals, arguments.engine, context_options, executor)
+
+        initial_weights = get_heuristic_weights()
+        weights, cost = tune_weights(initial_weights, lambda weights: evaluate(weights, tuning_deals))
+
+        baseline_cost = evaluate(initial_weights, validation_deals)
+        validation_cost = evaluate(weights, validation_deals)
+
+    print("Tuned weights:", weights)
+    print("Held out deals, states expanded: {:.0f} -> {:.0f}".format(baseline_cost, validation_cost))
+
+    if validation_cost >= baseline_cost:
+        print("The tuned weights are not better on the held out deals, not saving them", flush=True)
+        return
+
+    save_heuristic_weights(
+        arguments.output,
+        weights,
+        {
+            "engine": arguments.engine,
+            "options": context_options,
+            "seed": arguments.seed,
+            "deals": arguments.deals,
+            "baseline_cost": baseline_cost,
+            "tuned_cost": validation_cost,
+        },
+    )
+    print("Saved the weights to", arguments.output, flush=True)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Tunes the weights of the heuristic score to minimize the states expanded on a corpus of deals"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(SEARCH_ENGINES),
+        default="greedy",
+        help="search engine the weights are tuned for (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--deals",
+        type=int,
+        default=TUNING_DEALS,
+        help="number of deals tuned on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=TUNING_SEED,
+        help="seed of the deals tuned on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--validation-deals",
+        type=int,
+        default=VALIDATION_DEALS,
+        help="number of held out deals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--validation-seed",
+        type=int,
+        default=VALIDATION_SEED,
+        help="seed of the held out deals (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-states",
+        type=int,
+        default=MAX_STATES,
+        help="number of states searched per deal before giving up (default: %(default)s)",
+    )
+    parser.add_argument("--no-cheats", action="store_true", help="disallow cheating moves")
+    parser.add_argument(
+        "--output",
+        default=HEURISTIC_WEIGHTS_FILE,
+        help="file the tuned weights are written to (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def tune_weights(weights, evaluate):
+    """
+    Tunes the weights with a pattern search, evaluate(weights) returns the cost of the weights
+    Returns a 2-tuple (weights, cost) with the best found weights and their cost
+    """
+    weights = dict(weights)
+    cost = evaluate(weights)
+    steps = {name: abs(value) / 2 if value != 0 else 1 for name, value in weights.items()}
+    print("Initial cost: {:.0f}".format(cost), flush=True)
+
+    for round_number in range(TUNING_ROUNDS):
+        improved = False
+
+        for name in weights:
+            for direction in (1, -1):
+                candidate = dict(weights)
+                candidate[name] = weights[name] + direction * steps[name]
+
+                candidate_cost = evaluate(candidate)
+                if candidate_cost < cost:
+                    weights, cost = candidate, candidate_cost
+                    improved = True
+                    print("{} = {:g}, cost {:.0f}".format(name, weights[name], cost), flush=True)
+                    break
+
+        if not improved:
+            steps = {name: step / 2 for name, step in steps.items()}
+            if max(steps.values()) < MIN_STEP:
+                break
+
+        print("Round", round_number + 1, "cost {:.0f}".format(cost), flush=True)
+
+    return weights, cost
+
+
+def evaluate_weights(weights, deals, engine, context_options, executor):
+    """
+    Solves the deals with the given heuristic weights in the worker processes
+    Returns the total number of states expanded, deals that are not solved count as max_states expansions
+    """
+    futures = [
+        executor.submit(solve_deal, weights, stacks, engine, context_options) for stacks in deals
+    ]
+    max_states = context_options.get("max_states", MAX_STATES)
+
+    cost = 0
+    for future in futures:
+        solved, states_expanded = future.result()
+        cost += states_expanded if solved else max_states
+    return cost
+
+
+def solve_deal(weights, stacks, engine, context_options):
+    """
+    Solves a single deal with the given heuristic weights
+    Returns a 2-tuple (solved, states_expanded)
+    """
+    set_heuristic_weights(weights)
+    state = GameState.from_stacks(stacks)
+    result = run_search(engine, state, SearchContext(**context_options))
+    return result.solved, result.stats.states_expanded
+
+
+def save_heuristic_weights(path, weights, info=None):
+    """
+    Writes the weights into a JSON file, along with a dictionary describing how they were tuned
+    """
+    with open(path, "w") as weights_file:
+        json.dump({"weights": weights, "tuning": info or {}}, weights_file, indent=2)
+
+
+def load_heuristic_weights(path):
+    """
+    Loads the weights from a JSON file written by save_heuristic_weights and uses them for the heuristic score
+    Returns the loaded weights, or None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as weights_file:
+        weights = json.load(weights_file)["weights"]
+
+    set_heuristic_weights(weights)
+    return weights
+
+
+if __name__ == "__main__":
+    main()